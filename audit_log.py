@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Audit trail of the commands run through the bot, and a query tool for it.
+
+    python audit_log.py --dir logs/audit --user 123456 --since 2026-10-01 --command "rm -rf"
+"""
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import queue
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+CURRENT_SEGMENT = 'audit.jsonl'
+INDEX_NAME = 'index.db'
+# Records per write() call
+WRITE_BATCH = 256
+
+
+class AuditLog:
+    """Append-only JSON-lines record of who ran what, written off the request path.
+
+    record() only puts a dict on a queue. A writer thread takes everything
+    queued so far, replaces the output with its size and SHA-256 and appends
+    the batch to `directory`/audit.jsonl in a few large writes, at least every
+    `flush_interval` seconds. The segment is rotated once it reaches
+    `max_bytes` or its first record is `max_age` seconds old: it is gzipped
+    to audit-<first>-<last>.jsonl.gz and its time range and users go into
+    index.db, so search() opens only the segments that can match. Commands
+    may carry secrets, so files are created with mode 0600.
+    """
+
+    def __init__(self, directory='logs/audit', max_bytes=16 * 1024 * 1024, max_age=86400, flush_interval=1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = os.path.join(directory, CURRENT_SEGMENT)
+        self.queue = queue.SimpleQueue()
+        # Bounds of the current segment, for rotation and the index
+        self.first_time = None
+        self.last_time = None
+        self.records = 0
+        self.users = set()
+        self.file = None
+
+        index_path = os.path.join(directory, INDEX_NAME)
+        if not os.path.exists(index_path):
+            os.close(os.open(index_path, os.O_WRONLY | os.O_CREAT, 0o600))
+        # Only the writer thread touches the index after this
+        self.index = sqlite3.connect(index_path, check_same_thread=False)
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("""
+            CREATE TABLE IF NOT EXISTS segments (
+                name TEXT PRIMARY KEY,
+                first_time REAL NOT NULL,
+                last_time REAL NOT NULL,
+                records INTEGER NOT NULL
+            )
+        """)
+        self.index.execute("""
+            CREATE TABLE IF NOT EXISTS segment_users (
+                name TEXT NOT NULL,
+                tenant TEXT,
+                user_id INTEGER
+            )
+        """)
+        self.index.execute("CREATE INDEX IF NOT EXISTS segment_users_user ON segment_users (user_id, tenant)")
+
+        self.thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+        self.thread.start()
+
+    def record(self, **fields):
+        """Queue one record; an `output` field is stored as output_bytes and output_sha256"""
+        fields.setdefault('time', time.time())
+        self.queue.put(fields)
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def close(self):
+        """Write what is queued and stop; the current segment is picked up again on the next start"""
+        self.queue.put(None)
+        self.thread.join(timeout=10)
+
+    def _run(self):
+        self._open_segment()
+        closing = False
+        while not closing:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = None in batch
+
+            try:
+                records = [record for record in batch if record is not None]
+                # Slices keep a backlog from overshooting max_bytes by much
+                for start in range(0, len(records), WRITE_BATCH):
+                    self._write(records[start:start + WRITE_BATCH])
+                    if self.file.tell() >= self.max_bytes:
+                        self._rotate()
+                if self.records and time.time() - self.first_time >= self.max_age:
+                    self._rotate()
+            except Exception as e:
+                print(f"⚠️ Audit log write failed: {e}")
+        self.file.close()
+        self.index.close()
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            output = record.pop('output', None)
+            if output is not None:
+                data = output.encode('utf-8', errors='replace')
+                record['output_bytes'] = len(data)
+                record['output_sha256'] = hashlib.sha256(data).hexdigest()
+            lines.append(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            self._track(record)
+        self.file.write(''.join(lines).encode('utf-8'))
+        self.file.flush()
+
+    def _track(self, record):
+        if self.first_time is None:
+            self.first_time = record['time']
+        self.last_time = record['time']
+        self.records += 1
+        self.users.add((record.get('tenant'), record.get('user')))
+
+    def _open_segment(self):
+        """Open audit.jsonl for appending, rebuilding the bounds of a segment left by the last run"""
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        self._track(json.loads(line))
+                    except ValueError:
+                        # Torn last line of a crash
+                        continue
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self.file = os.fdopen(fd, 'ab')
+
+    def _rotate(self):
+        self.file.close()
+        stamp = '-'.join(datetime.fromtimestamp(value).strftime('%Y%m%d%H%M%S')
+                         for value in (self.first_time, self.last_time))
+        name = f"audit-{stamp}.jsonl.gz"
+        suffix = 1
+        while os.path.exists(os.path.join(self.directory, name)):
+            suffix += 1
+            name = f"audit-{stamp}-{suffix}.jsonl.gz"
+
+        target = os.path.join(self.directory, name)
+        fd = os.open(target + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(self.path, 'rb') as source, os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as sink:
+            shutil.copyfileobj(source, sink, 1024 * 1024)
+        os.replace(target + '.tmp', target)
+
+        # A crash before this commit leaves an unindexed segment, search() still scans it
+        with self.index:
+            self.index.execute("INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?)",
+                               (name, self.first_time, self.last_time, self.records))
+            self.index.executemany("INSERT INTO segment_users VALUES (?, ?, ?)",
+                                   [(name, tenant, user) for tenant, user in self.users])
+        os.remove(self.path)
+
+        self.first_time = self.last_time = None
+        self.records = 0
+        self.users = set()
+        self._open_segment()
+
+
+def candidate_segments(directory, user=None, tenant=None, since=None, until=None):
+    """Segment paths that may hold matching records, oldest first"""
+    index_path = os.path.join(directory, INDEX_NAME)
+    indexed = set()
+    matching = []
+    if os.path.exists(index_path):
+        db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        try:
+            indexed = {name for (name,) in db.execute("SELECT name FROM segments")}
+            query = "SELECT name FROM segments WHERE last_time >= ? AND first_time <= ?"
+            params = [since if since is not None else 0, until if until is not None else float('inf')]
+            if user is not None or tenant is not None:
+                query += " AND name IN (SELECT name FROM segment_users WHERE 1"
+                if user is not None:
+                    query += " AND user_id = ?"
+                    params.append(user)
+                if tenant is not None:
+                    query += " AND tenant = ?"
+                    params.append(tenant)
+                query += ")"
+            matching = [name for (name,) in db.execute(query + " ORDER BY first_time, rowid", params)]
+        finally:
+            db.close()
+
+    paths = [os.path.join(directory, name) for name in matching]
+    # Segments rotated without reaching the index, and the one being written
+    paths += sorted(path for path in glob.glob(os.path.join(directory, 'audit-*.jsonl.gz'))
+                    if os.path.basename(path) not in indexed)
+    current = os.path.join(directory, CURRENT_SEGMENT)
+    if os.path.exists(current):
+        paths.append(current)
+    return paths
+
+
+def search(directory, user=None, tenant=None, since=None, until=None, command=None):
+    """Records matching every given filter, oldest first; since and until are epoch seconds"""
+    for path in candidate_segments(directory, user, tenant, since, until):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if user is not None and record.get('user') != user:
+                    continue
+                if tenant is not None and record.get('tenant') != tenant:
+                    continue
+                if since is not None and record['time'] < since:
+                    continue
+                if until is not None and record['time'] > until:
+                    continue
+                if command is not None and command not in record.get('command', ''):
+                    continue
+                yield record
+
+
+def format_record(record):
+    exit_code = record.get('exit_code')
+    status = '-' if exit_code is None else exit_code
+    digest = record.get('output_sha256', '')[:12] or record.get('output_ref', '')
+    hosts = f"  ({len(record['hosts'])} hosts)" if record.get('hosts') else ''
+    return (f"{datetime.fromtimestamp(record['time']):%Y-%m-%d %H:%M:%S}  {record.get('tenant', '')}  "
+            f"{record.get('user', '')}  {record.get('action', 'shell'):<6} exit {status}  "
+            f"{record.get('duration', 0):.2f}s  {record.get('output_bytes', 0)}B {digest}  "
+            f"{record.get('command', '')}{hosts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=os.getenv('AUDIT_LOG_DIR') or 'logs/audit')
+    parser.add_argument('--user', type=int)
+    parser.add_argument('--tenant')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='e.g. 2026-10-01 or "2026-10-01 12:00"')
+    parser.add_argument('--until', type=datetime.fromisoformat)
+    parser.add_argument('--command', help='substring of the command')
+    parser.add_argument('--limit', type=int, default=0, help='stop after this many records')
+    parser.add_argument('--json', action='store_true', help='print the records as JSON lines')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        print(f"❌ No audit log in {args.dir}")
+        sys.exit(1)
+
+    records = search(
+        args.dir, user=args.user, tenant=args.tenant,
+        since=args.since.timestamp() if args.since else None,
+        until=args.until.timestamp() if args.until else None,
+        command=args.command
+    )
+    for count, record in enumerate(records, 1):
+        print(json.dumps(record, ensure_ascii=False) if args.json else format_record(record))
+        if count == args.limit:
+            break
+
+
+if __name__ == "__main__":
+    main()
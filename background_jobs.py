@@ -0,0 +1,198 @@
+import os
+import time
+import shlex
+import select
+import threading
+from collections import OrderedDict
+
+
+class BackgroundJobManager:
+    """Long-running commands on their own SSH channels, off the interactive shell.
+
+    Every job runs via exec_command on a pooled transport. A single reader
+    thread multiplexes all job channels with select(), appends their output to
+    a size-bounded log under `log_dir` and calls the job's on_finish callback
+    when the remote command exits.
+    """
+
+    def __init__(self, pool, ssh_host, ssh_port=22, ssh_username='root', ssh_password='',
+                 log_dir='logs/jobs', max_log_bytes=1024 * 1024, max_running=5, max_history=50,
+                 governor=None, audit=None, audit_key='default'):
+        self.pool = pool
+        self.ssh_host = ssh_host
+        self.ssh_port = ssh_port
+        self.ssh_username = ssh_username
+        self.ssh_password = ssh_password
+        self.log_dir = log_dir
+        self.max_log_bytes = max_log_bytes
+        self.max_running = max_running
+        self.max_history = max_history
+        # Optional ResourceGovernor, job channels count towards the per-user cap
+        self.governor = governor
+        # Optional AuditLog, finished jobs are recorded with their log as the output reference
+        self.audit = audit
+        self.audit_key = audit_key
+
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.next_id = 1
+        self.reader_thread = None
+
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def start(self, user_id, command, cwd=None, env=None, on_finish=None):
+        """Start a job, returns the job dict or raises RuntimeError when over the limit"""
+        with self.lock:
+            running = [job for job in self.jobs.values()
+                       if job['user_id'] == user_id and job['status'] == 'running']
+            if len(running) >= self.max_running:
+                raise RuntimeError(f"Too many background jobs ({self.max_running} running)")
+            job_id = self.next_id
+            self.next_id += 1
+
+        setup = [f'export {name}={shlex.quote(value)}' for name, value in (env or {}).items()]
+        if cwd:
+            # A job must not fall back to $HOME when its directory is gone
+            setup.append(f'cd {shlex.quote(cwd)} || exit 1')
+        remote_command = '; '.join(setup + [command]) if setup else command
+
+        if self.governor is not None:
+            self.governor.acquire_job(user_id)
+        try:
+            channel = self.pool.open_session(self.ssh_host, self.ssh_port, self.ssh_username, self.ssh_password)
+            channel.set_combine_stderr(True)
+            channel.exec_command(remote_command)
+        except Exception:
+            if self.governor is not None:
+                self.governor.release_job(user_id)
+            raise
+
+        job = {
+            'id': job_id,
+            'user_id': user_id,
+            'command': command,
+            'status': 'running',
+            'exit_code': None,
+            'started': time.time(),
+            'finished': None,
+            'bytes': 0,
+            # Ids restart at 1 with the process, the start time keeps audit references unique
+            'log_path': os.path.join(self.log_dir, f"job_{time.strftime('%Y%m%d-%H%M%S')}_{job_id}.log"),
+            'channel': channel,
+            'on_finish': on_finish
+        }
+        job['log'] = open(job['log_path'], 'wb')
+
+        with self.lock:
+            self.jobs[job_id] = job
+            self._trim_history()
+            if self.reader_thread is None:
+                self.reader_thread = threading.Thread(target=self._reader_loop, name='bg-jobs', daemon=True)
+                self.reader_thread.start()
+        return job
+
+    def list_jobs(self, user_id):
+        with self.lock:
+            return [self._public(job) for job in self.jobs.values() if job['user_id'] == user_id]
+
+    def get_job(self, user_id, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['user_id'] != user_id:
+                return None
+            return self._public(job)
+
+    def tail(self, user_id, job_id, lines=40):
+        """Last lines of a job's log, or None if the job is unknown"""
+        job = self.get_job(user_id, job_id)
+        if job is None:
+            return None
+
+        # Read at most ~64 bytes per requested line from the end of the log
+        wanted = lines * 64
+        data = b''
+        for path in (job['log_path'], job['log_path'] + '.1'):
+            if len(data) >= wanted or not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - (wanted - len(data))))
+                data = f.read() + data
+        text = data.decode('utf-8', errors='replace').replace('\r\n', '\n')
+        return '\n'.join(text.splitlines()[-lines:])
+
+    def runtime(self, job):
+        return int((job['finished'] or time.time()) - job['started'])
+
+    def _reader_loop(self):
+        while True:
+            with self.lock:
+                running = [job for job in self.jobs.values() if job['status'] == 'running']
+                if not running:
+                    # start() spawns a new reader for the next job
+                    self.reader_thread = None
+                    return
+
+            channels = {job['channel']: job for job in running}
+            readable, _, _ = select.select(list(channels), [], [], 1.0)
+            for channel in readable:
+                self._drain(channels[channel])
+            for job in running:
+                if job['channel'].exit_status_ready() and not job['channel'].recv_ready():
+                    self._finish(job)
+
+    def _drain(self, job):
+        channel = job['channel']
+        while channel.recv_ready():
+            chunk = channel.recv(32768)
+            if not chunk:
+                break
+            job['bytes'] += len(chunk)
+            job['log'].write(chunk)
+        job['log'].flush()
+
+        # Bounded log: keep the current file plus one rotated segment
+        if job['log'].tell() > self.max_log_bytes:
+            job['log'].close()
+            os.replace(job['log_path'], job['log_path'] + '.1')
+            job['log'] = open(job['log_path'], 'wb')
+
+    def _finish(self, job):
+        self._drain(job)
+        job['exit_code'] = job['channel'].recv_exit_status()
+        job['finished'] = time.time()
+        job['status'] = 'done' if job['exit_code'] == 0 else 'failed'
+        job['log'].close()
+        self.pool.release(job['channel'])
+        if self.governor is not None:
+            self.governor.release_job(job['user_id'])
+        if self.audit is not None:
+            self.audit.record(
+                tenant=self.audit_key,
+                user=job['user_id'],
+                action='bg',
+                id=f"bg{job['id']}",
+                command=job['command'],
+                exit_code=job['exit_code'],
+                duration=round(job['finished'] - job['started'], 3),
+                output_bytes=job['bytes'],
+                output_ref=job['log_path']
+            )
+
+        if job['on_finish']:
+            try:
+                job['on_finish'](self._public(job))
+            except Exception as e:
+                print(f"Background job {job['id']} notify error: {e}")
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] != 'running']
+        for job_id in finished[:max(0, len(self.jobs) - self.max_history)]:
+            job = self.jobs.pop(job_id)
+            for path in (job['log_path'], job['log_path'] + '.1'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _public(self, job):
+        return {key: value for key, value in job.items() if key not in ('channel', 'log', 'on_finish')}
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the shell output reader on multi-MB outputs.
+
+Compares the old approach (decode each recv() chunk and concatenate
+strings) with OutputReader (bytearray buffer, incremental UTF-8 decoding,
+single-pass ANSI stripping). The input is Korean text with ANSI colours, so
+multibyte characters regularly straddle chunk boundaries.
+
+    python benchmarks/bench_output_reader.py --sizes 1 4 16 --chunk 4096
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from output_reader import OutputReader, MARKER_PREFIX
+
+TOKEN = 'abcdef012345'
+LINE = '\x1b[32m2024-01-01 12:00:00\x1b[0m 배포 진행 중: 서비스 재시작 완료 (status=ok)\r\n'
+
+
+def make_output(megabytes):
+    line = LINE.encode('utf-8')
+    body = line * (megabytes * 1024 * 1024 // len(line))
+    return body + f'\r\n{MARKER_PREFIX}{TOKEN}_0:/root__\r\n'.encode('ascii')
+
+
+def chunks(data, size):
+    view = memoryview(data)
+    return [bytes(view[i:i + size]) for i in range(0, len(data), size)]
+
+
+def naive_reader(parts):
+    """The pre-OutputReader loop: per-chunk decode and string concatenation"""
+    output = ''
+    errors = 0
+    for chunk in parts:
+        try:
+            output += chunk.decode('utf-8')
+        except UnicodeDecodeError:
+            # This is what used to trigger a needless reconnect
+            errors += 1
+    return output, errors
+
+
+def naive_bytes_reader(parts):
+    """Immutable bytes concatenation, the other common pattern, quadratic in size"""
+    output = b''
+    for chunk in parts:
+        output += chunk
+        keep = output
+    return keep.decode('utf-8', errors='replace')
+
+
+def output_reader(parts):
+    reader = OutputReader(TOKEN)
+    for chunk in parts:
+        reader.feed(chunk)
+        if reader.finished:
+            break
+    return reader.text(), reader
+
+
+def measure(function, parts, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(parts)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 8], help='output sizes in MB')
+    parser.add_argument('--chunk', type=int, default=4096, help='recv() chunk size in bytes')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'str +=':>12} {'bytes +=':>12} {'OutputReader':>13} {'decode errors':>14}")
+    for megabytes in args.sizes:
+        parts = chunks(make_output(megabytes), args.chunk)
+        naive_time, (_, errors) = measure(naive_reader, parts, args.repeat)
+        bytes_time, _ = measure(naive_bytes_reader, parts, 1)
+        reader_time, (text, reader) = measure(output_reader, parts, args.repeat)
+
+        # Sanity checks: complete, clean, and marker detected
+        assert reader.exit_code == 0 and reader.cwd == '/root'
+        assert '\x1b' not in text and '\ufffd' not in text and '\r' not in text
+        if not reader.omitted:
+            assert text.count('\n') + 1 == text.count('배포')
+
+        print(f"{megabytes:>4}MB {megabytes / naive_time:>9.1f}MB/s {megabytes / bytes_time:>9.1f}MB/s "
+              f"{megabytes / reader_time:>10.1f}MB/s {errors:>14}")
+
+    print("\nstr += loses every chunk with a split character (decode errors) and keeps ANSI codes;")
+    print("OutputReader output is complete, decoded and stripped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end benchmark of the bot.
+
+Boots the real bot module from a config snapshot (no web config fetch) and
+drives its handlers with synthetic users. SSH goes to a local paramiko
+server that answers every command after --delay seconds with --output-bytes
+of text; Bot API calls go to an in-process stub. Nothing leaves the machine,
+so runs of two builds are comparable.
+
+Phases: every user sends /start, then --burst commands at once, then one
+/claude query, then /stop. Reported per phase: throughput and latency
+percentiles (update in -> handler done), then resident memory per open
+session, Bot API calls and the bot's own /stats stage table.
+
+    python benchmarks/bot_bench.py --users 32 --burst 5 --delay 0.05 --output-bytes 2000
+
+The SSH server runs in a child process so its memory and CPU do not count
+towards the bot's numbers.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import paramiko
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+from output_reader import MARKER_PREFIX
+from config_loader import WebConfigLoader
+
+# Same pattern load_test.py uses to find the marker request of a command
+MARKER_REQUEST = re.compile(r"' ([0-9a-f]+) \$\? \"\$PWD\"\n")
+COMMAND_BLOCK = re.compile(r"\{ (.*?)\n\}; printf", re.S)
+PASSWORD = 'bench-password'
+WEB_CONFIG_URL = 'https://bzjay53.github.io/devbot'
+
+
+class ShellServer(paramiko.ServerInterface):
+    """Accepts any password and gives every channel a fake shell"""
+
+    def __init__(self, delay, output_bytes, claude_delay, claude_bytes):
+        self.delay = delay
+        self.output_bytes = output_bytes
+        self.claude_delay = claude_delay
+        self.claude_bytes = claude_bytes
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=self.run_shell, args=(channel,), daemon=True).start()
+        return True
+
+    def run_shell(self, channel):
+        """Answer each marker-terminated command like the quiet shell the bot sets up"""
+        buffer = ''
+        cwd = '/home/bench'
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                return
+            buffer += data.decode('utf-8', errors='replace')
+            while True:
+                marker = MARKER_REQUEST.search(buffer)
+                if marker is None:
+                    break
+                block = COMMAND_BLOCK.search(buffer, 0, marker.end())
+                command = block.group(1) if block else ''
+                buffer = buffer[marker.end():]
+
+                if command.startswith(('cd ', 'export ', 'printf ')):
+                    # Session setup and env queries answer right away
+                    output = ''
+                elif 'claude' in command:
+                    time.sleep(self.claude_delay)
+                    output = synthetic_output(self.claude_bytes)
+                else:
+                    time.sleep(self.delay)
+                    output = synthetic_output(self.output_bytes)
+                channel.sendall(f"{output}\n{MARKER_PREFIX}{marker.group(1)}_0:{cwd}__\n".encode())
+
+
+def synthetic_output(size):
+    line = "drwxr-xr-x  2 bench bench 4096 Jan  1 12:00 some-directory-name\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+def serve_ssh(port_queue, delay, output_bytes, claude_delay, claude_bytes):
+    """Child process: accept SSH connections until killed"""
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    port_queue.put(listener.getsockname()[1])
+    while True:
+        client, _ = listener.accept()
+        transport = paramiko.Transport(client)
+        transport.add_server_key(host_key)
+        transport.start_server(server=ShellServer(delay, output_bytes, claude_delay, claude_bytes))
+
+
+class StubBotAPI(BaseRequest):
+    """Answers Bot API calls locally after `latency` seconds and counts them"""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = {}
+        self.message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif endpoint in ('sendMessage', 'editMessageText', 'sendDocument'):
+            self.message_id += 1
+            chat_id = params.get('chat_id', 1)
+            result = {
+                'message_id': params.get('message_id', self.message_id), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class StubJobQueue:
+    """Stands in for JobQueue when APScheduler is not installed, reminders are not part of the run"""
+
+    def set_application(self, application):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self, wait=True):
+        pass
+
+    def run_repeating(self, *args, **kwargs):
+        return None
+
+    def get_jobs_by_name(self, name):
+        return []
+
+
+def message_update(update_id, user_id, text):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+        'text': text
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def rss_bytes():
+    """Current resident set size, peak size where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def configure_environment(args, ssh_port, workdir, user_ids):
+    """Env and config snapshot the bot module reads at import"""
+    os.environ.update({
+        'WEB_PASSWORD': PASSWORD,
+        'CONFIG_SNAPSHOT_PATH': os.path.join(workdir, 'config_snapshot.json'),
+        'SESSION_JOURNAL_PATH': os.path.join(workdir, 'sessions.db'),
+        'JOB_LOG_DIR': os.path.join(workdir, 'jobs'),
+        'OUTPUT_STORE_DIR': os.path.join(workdir, 'outputs'),
+        'FILE_SPOOL_DIR': os.path.join(workdir, 'transfers'),
+        'AUDIT_LOG_DIR': os.path.join(workdir, 'audit'),
+        'HISTORY_PATH': os.path.join(workdir, 'history.db'),
+        'METRICS_PORT': '0',
+        'WEBHOOK_URL': '',
+        'MULTI_BOT': 'false',
+        'COMMAND_WORKERS': str(max(16, args.users)),
+        'MAX_QUEUE_DEPTH': str(max(5, args.burst)),
+        'MAX_OPEN_SHELLS': str(args.users * 2),
+        'SSH_POOL_MAX_TRANSPORTS': str(args.users // 8 + 2),
+        'STREAM_INTERVAL': str(args.stream_interval)
+    })
+    if not args.telegram_limits:
+        # Measure the bot itself, not Telegram's flood limits
+        os.environ.update({'OUTBOUND_GLOBAL_RATE': '100000', 'OUTBOUND_CHAT_RATE': '100000',
+                           'OUTBOUND_CHAT_BURST': '100000'})
+
+    ids = ','.join(str(user_id) for user_id in user_ids)
+    config = {
+        'projectName': 'bench', 'botToken': '123:bench', 'chatId': ids,
+        'sshHost': f'127.0.0.1:{ssh_port}', 'sshUsername': 'bench', 'sshPassword': 'bench',
+        'workingDir': '/home/bench'
+    }
+    # The snapshot key covers the bot's WEB_CONFIG_URL and password, the web page is never contacted
+    loader = WebConfigLoader(WEB_CONFIG_URL, PASSWORD, snapshot_path=os.environ['CONFIG_SNAPSHOT_PATH'])
+    loader.config_cache = config
+    loader.bots_cache = [config]
+    loader.save_snapshot()
+
+
+def offline_application(stub_api):
+    """Replacement for the bot's Application whose builder never talks to Telegram"""
+
+    class OfflineApplication:
+        @staticmethod
+        def builder():
+            return (Application.builder().request(stub_api).get_updates_request(stub_api)
+                    .updater(None).job_queue(StubJobQueue()))
+
+    return OfflineApplication
+
+
+class Driver:
+    """Feeds synthetic updates into the tenant's Application and times each one"""
+
+    def __init__(self, app):
+        self.app = app
+        self.update_id = 0
+
+    async def send(self, user_id, text):
+        self.update_id += 1
+        update = Update.de_json(message_update(self.update_id, user_id, text), self.app.bot)
+        started = time.perf_counter()
+        await self.app.process_update(update)
+        return time.perf_counter() - started
+
+    async def phase(self, name, user_ids, texts, report):
+        """Every user sends `texts` at once, all users together"""
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(
+            self.send(user_id, text) for user_id in user_ids for text in texts
+        ))
+        wall = time.perf_counter() - started
+        report.append((name, len(latencies), wall, latencies))
+        return latencies
+
+
+async def run(args, user_ids):
+    import telegram_terminal_bot_persistent as bot
+
+    stub_api = StubBotAPI(latency=args.api_latency)
+    bot.Application = offline_application(stub_api)
+    bot.register_gauges()
+
+    apps = []
+    for key, (name, env) in bot.tenant_configs().items():
+        tenant = bot.build_tenant(key, name, env)
+        app = bot.build_application(tenant)
+        await app.initialize()
+        await app.start()
+        tenant.application = app
+        bot.tenants[key] = tenant
+        apps.append(app)
+    driver = Driver(apps[0])
+
+    report = []
+    baseline = rss_bytes()
+    await driver.phase('start', user_ids, ['/start'], report)
+    opened = rss_bytes()
+    await driver.phase('burst', user_ids, [args.command] * args.burst, report)
+    await driver.phase('claude', user_ids, [f'/claude {args.query}'], report)
+    peak = rss_bytes()
+    stats = bot.format_stats()
+    await driver.phase('stop', user_ids, ['/stop'], report)
+
+    for app in apps:
+        await app.stop()
+        await app.shutdown()
+    bot.fanout.shutdown()
+    bot.ssh_pool.close_all()
+    bot.fanout_pool.close_all()
+    if bot.session_journal is not None:
+        bot.session_journal.close()
+    return report, (baseline, opened, peak), stub_api.calls, stats
+
+
+def print_report(args, report, memory, calls, stats):
+    print(f"\nusers={args.users} burst={args.burst} delay={args.delay}s output={args.output_bytes}B "
+          f"api_latency={args.api_latency}s telegram_limits={args.telegram_limits}")
+    print(f"{'phase':<8}{'updates':>8}{'per s':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, count, wall, latencies in report:
+        print(f"{name:<8}{count:>8}{count / wall:>9.1f}" +
+              ''.join(f"{value * 1000:>8.1f}ms" for value in (
+                  statistics.median(latencies), percentile(latencies, 95), percentile(latencies, 99), max(latencies)
+              )))
+
+    baseline, opened, peak = memory
+    print(f"\nmemory   {baseline / (1024 * 1024):.1f} MB idle, {opened / (1024 * 1024):.1f} MB with sessions open, "
+          f"{peak / (1024 * 1024):.1f} MB after the burst")
+    print(f"         {(opened - baseline) / args.users / 1024:.1f} KB per open session, "
+          f"{(peak - baseline) / args.users / 1024:.1f} KB per session after the burst")
+    print("bot api  " + ', '.join(f"{endpoint} {count}" for endpoint, count in sorted(calls.items())))
+    print(f"\n{stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--burst', type=int, default=5, help='commands each user sends at once')
+    parser.add_argument('--command', default='ls -la')
+    parser.add_argument('--query', default='explain this repository')
+    parser.add_argument('--delay', type=float, default=0.05, help='remote execution time of a command in seconds')
+    parser.add_argument('--output-bytes', type=int, default=2000, help='output size of a command')
+    parser.add_argument('--claude-delay', type=float, default=0.5)
+    parser.add_argument('--claude-bytes', type=int, default=6000)
+    parser.add_argument('--api-latency', type=float, default=0.02, help='round trip of a stub Bot API call')
+    parser.add_argument('--stream-interval', type=float, default=1.5)
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help="keep the bot's default outbound rate limits instead of lifting them")
+    args = parser.parse_args()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve_ssh, args=(port_queue, args.delay, args.output_bytes, args.claude_delay, args.claude_bytes),
+        daemon=True
+    )
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='devbot-bench-')
+    try:
+        user_ids = [1000 + index for index in range(args.users)]
+        configure_environment(args, port_queue.get(timeout=30), workdir, user_ids)
+        report, memory, calls, stats = asyncio.run(run(args, user_ids))
+    finally:
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(args, report, memory, calls, stats)
+    updates = sum(count for name, count, wall, latencies in report)
+    # Every update is answered with at least one new message
+    if calls.get('sendMessage', 0) < updates:
+        print("❌ The bot did not answer")
+        sys.exit(1)
+    print("✅ Benchmark finished")
+
+
+if __name__ == "__main__":
+    main()
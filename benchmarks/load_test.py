@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Concurrent command load test for SessionManager.
+
+Runs the same command for 1 user and then for N users at once against an
+in-memory fake SSH server, and compares the latencies. With the async
+execution layer the N-user latency should stay close to the single-user one.
+
+    python benchmarks/load_test.py --users 32 --rounds 3
+"""
+import os
+import sys
+import re
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ssh_pool
+from session_manager import SessionManager, MARKER_PREFIX
+
+MARKER_REQUEST = re.compile(r"' ([0-9a-f]+) \$\?")
+
+
+class FakeChannel:
+    """Minimal stand-in for a paramiko shell channel"""
+
+    def __init__(self, client, delay):
+        self.client = client
+        self.delay = delay
+        self.buffer = bytearray()
+        self.ready = threading.Condition()
+        self.timeout = None
+        self.closed = False
+
+    def send(self, data):
+        marker = MARKER_REQUEST.search(data)
+
+        def respond():
+            time.sleep(self.delay)
+            reply = "ok\n"
+            if marker:
+                reply += f"\n{MARKER_PREFIX}{marker.group(1)}_0:/home/bench__\n"
+            with self.ready:
+                self.buffer += reply.encode('utf-8')
+                self.ready.notify_all()
+        threading.Thread(target=respond, daemon=True).start()
+        return len(data)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv_ready(self):
+        with self.ready:
+            return len(self.buffer) > 0
+
+    def recv(self, size):
+        with self.ready:
+            if not self.buffer and not self.ready.wait_for(lambda: self.buffer, self.timeout):
+                raise socket.timeout()
+            chunk = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return chunk
+
+    def close(self):
+        self.closed = True
+
+    def get_transport(self):
+        return self.client
+
+
+class FakeSSHClient:
+    """Minimal stand-in for paramiko.SSHClient"""
+    command_delay = 0.05
+    handshakes = 0
+
+    def __init__(self):
+        self.active = False
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, *args, **kwargs):
+        FakeSSHClient.handshakes += 1
+        self.active = True
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        pass
+
+    def invoke_shell(self, width=80, height=24):
+        return FakeChannel(self, self.command_delay)
+
+    def close(self):
+        self.active = False
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def timed_command(manager, user_id, command):
+    started = time.perf_counter()
+    await manager.run_command(user_id, command)
+    return time.perf_counter() - started
+
+
+async def run(users, rounds, command):
+    manager = SessionManager('fake-host', max_workers=users)
+    await asyncio.gather(*(manager.start_session(user_id) for user_id in range(users)))
+    pool_stats = manager.pool.stats()
+
+    single = [await timed_command(manager, 0, command) for _ in range(rounds)]
+
+    concurrent = []
+    wall_started = time.perf_counter()
+    for _ in range(rounds):
+        concurrent += await asyncio.gather(
+            *(timed_command(manager, user_id, command) for user_id in range(users))
+        )
+    wall = time.perf_counter() - wall_started
+
+    for user_id in range(users):
+        manager.stop_session(user_id)
+    manager.executor.shutdown()
+
+    single_p50 = statistics.median(single)
+    print(f"users={users} rounds={rounds} command={command!r}")
+    print(f"single user   p50={single_p50 * 1000:8.1f} ms")
+    print(f"{users:3d} users     p50={statistics.median(concurrent) * 1000:8.1f} ms  "
+          f"p95={percentile(concurrent, 95) * 1000:8.1f} ms  "
+          f"max={max(concurrent) * 1000:8.1f} ms")
+    print(f"throughput    {len(concurrent) / wall:8.1f} commands/s")
+    print(f"ssh pool      {FakeSSHClient.handshakes} handshakes, {pool_stats['transports']} transports, "
+          f"{pool_stats['channels']} channels")
+
+    ratio = percentile(concurrent, 95) / single_p50
+    print(f"p95 / single  {ratio:8.2f}x")
+    return ratio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--command', default='echo hello')
+    parser.add_argument('--command-delay', type=float, default=0.05,
+                        help='simulated remote execution time in seconds')
+    parser.add_argument('--max-ratio', type=float, default=1.5,
+                        help='fail if concurrent p95 exceeds single-user p50 by this factor')
+    args = parser.parse_args()
+
+    ssh_pool.paramiko.SSHClient = FakeSSHClient
+    FakeSSHClient.command_delay = args.command_delay
+
+    ratio = asyncio.run(run(args.users, args.rounds, args.command))
+    if ratio > args.max_ratio:
+        print(f"❌ Concurrent latency degraded more than {args.max_ratio}x")
+        sys.exit(1)
+    print("✅ Concurrent latency stays close to single-user latency")
+
+
+if __name__ == "__main__":
+    main()
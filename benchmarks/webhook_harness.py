@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Offline webhook throughput/latency harness.
+
+Starts the embedded WebhookServer with a real python-telegram-bot
+Application behind it, whose Bot API calls go to an in-process fake instead
+of api.telegram.org. Synthetic message updates are POSTed over keep-alive
+connections (like Telegram does, up to max_connections); an echo handler
+replies to each one. Reported per concurrent_updates setting:
+
+  ack latency   POST sent -> HTTP 200 (what Telegram waits for)
+  end-to-end    POST sent -> sendMessage reached the Bot API
+
+    python benchmarks/webhook_harness.py --updates 2000 --connections 40 --concurrency 1,16,64
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+from telegram.request import BaseRequest
+from webhook_server import WebhookServer
+
+SECRET = 'bench-secret'
+PATH = '/telegram/bench'
+
+
+class FakeBotAPI(BaseRequest):
+    """Answers Bot API calls locally and records when each reply was sent"""
+
+    def __init__(self):
+        self.replies = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif endpoint == 'sendMessage':
+            self.replies[int(params['text'])] = time.perf_counter()
+            result = {
+                'message_id': int(params['text']), 'date': int(time.time()),
+                'chat': {'id': params['chat_id'], 'type': 'private'}, 'text': params['text']
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def synthetic_update(update_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': 1000 + update_id % 50, 'type': 'private'},
+            'from': {'id': 1000 + update_id % 50, 'is_bot': False, 'first_name': 'user'},
+            'text': str(update_id)
+        }
+    }
+
+
+async def post(reader, writer, path, body, secret):
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = int(next(line.split(b':', 1)[1] for line in head.split(b'\r\n')
+                      if line.lower().startswith(b'content-length')))
+    await reader.readexactly(length)
+    return status
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(updates, connections, concurrency, work):
+    api = FakeBotAPI()
+    app = (Application.builder().token('123:bench').request(api).get_updates_request(FakeBotAPI())
+           .updater(None).concurrent_updates(concurrency).build())
+
+    async def echo(update, context):
+        # Stands in for handler work (session lookup, SSH round trip, ...)
+        await asyncio.sleep(work)
+        await update.message.reply_text(update.message.text)
+
+    app.add_handler(MessageHandler(filters.TEXT, echo))
+    await app.initialize()
+    await app.start()
+
+    server = WebhookServer('127.0.0.1', 0)
+
+    async def enqueue(data):
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+    server.add_route(PATH, SECRET, enqueue)
+    await server.start()
+
+    sent = {}
+    acks = []
+    queue = asyncio.Queue()
+    for update_id in range(1, updates + 1):
+        queue.put_nowait(update_id)
+
+    async def connection():
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        while not queue.empty():
+            update_id = queue.get_nowait()
+            body = json.dumps(synthetic_update(update_id)).encode()
+            sent[update_id] = time.perf_counter()
+            status = await post(reader, writer, PATH, body, SECRET)
+            acks.append(time.perf_counter() - sent[update_id])
+            assert status == 200, status
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection() for _ in range(connections)))
+    while len(api.replies) < updates:
+        await asyncio.sleep(0.01)
+    wall = time.perf_counter() - started
+
+    # Requests with a wrong secret must be refused
+    reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+    forged = await post(reader, writer, PATH, json.dumps(synthetic_update(0)).encode(), 'wrong')
+    writer.close()
+
+    await server.stop()
+    await app.stop()
+    await app.shutdown()
+
+    end_to_end = [api.replies[update_id] - sent[update_id] for update_id in sent]
+    print(f"concurrent_updates={concurrency:<4d} "
+          f"throughput={updates / wall:8.1f} updates/s  "
+          f"ack p50={statistics.median(acks) * 1000:6.2f} ms p95={percentile(acks, 95) * 1000:6.2f} ms  "
+          f"end-to-end p50={statistics.median(end_to_end) * 1000:8.1f} ms "
+          f"p95={percentile(end_to_end, 95) * 1000:8.1f} ms  forged={forged}")
+    return forged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--connections', type=int, default=40,
+                        help='parallel keep-alive connections (setWebhook max_connections)')
+    parser.add_argument('--concurrency', default='1,16,64',
+                        help='comma separated concurrent_updates values to compare')
+    parser.add_argument('--work-ms', type=float, default=5,
+                        help='simulated handler time per update')
+    args = parser.parse_args()
+
+    print(f"updates={args.updates} connections={args.connections} handler work={args.work_ms} ms")
+    for concurrency in (int(value) for value in args.concurrency.split(',')):
+        forged = asyncio.run(run(args.updates, args.connections, concurrency, args.work_ms / 1000))
+        if forged != 403:
+            print(f"❌ Request with a wrong secret token got {forged}")
+            sys.exit(1)
+    print("✅ Secret token enforced")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import os
+import zlib
+import sqlite3
+import threading
+
+# The trigram index needs this many characters, shorter patterns scan recent entries
+MIN_INDEXED_PATTERN = 3
+SCAN_LIMIT = 500
+# Old entries are pruned once per this many new ones
+PRUNE_EVERY = 50
+
+
+class CommandHistory:
+    """Per-user history of commands and their outputs in SQLite, searchable with FTS5.
+
+    Every executed command gets a number per (tenant, user) that keeps
+    counting across sessions, so `!n` stays valid after a /stop. Outputs are
+    kept zlib-compressed and cut to their last `max_output_chars`. The FTS5
+    table is contentless with the trigram tokenizer: it finds substrings the
+    way grep does without storing the text twice. Only the newest
+    `max_entries` per user are kept. Outputs can hold secrets, so the file
+    is created with mode 0600.
+    """
+
+    def __init__(self, path='data/history.db', max_entries=1000, max_output_chars=64 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_output_chars = max_output_chars
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+
+        self.lock = threading.Lock()
+        # Written from the SSH worker threads, read by handlers via to_thread, serialized by self.lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY,
+                tenant TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                number INTEGER NOT NULL,
+                session TEXT,
+                time REAL NOT NULL,
+                command TEXT NOT NULL,
+                exit_code INTEGER,
+                cwd TEXT,
+                output_chars INTEGER NOT NULL,
+                output BLOB NOT NULL
+            )
+        """)
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS history_number ON history (tenant, user_id, number)")
+        self.db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(command, output, content='', tokenize='trigram')"
+        )
+
+    def add(self, tenant, user_id, session, command, output, exit_code, cwd, time):
+        """Record a finished command, returns its number"""
+        kept = output
+        if len(output) > self.max_output_chars:
+            kept = f"... ({len(output) - self.max_output_chars} earlier characters not kept)\n" \
+                   + output[-self.max_output_chars:]
+        compressed = zlib.compress(kept.encode('utf-8', errors='replace'), 6)
+
+        with self.lock, self.db:
+            (last,) = self.db.execute(
+                "SELECT MAX(number) FROM history WHERE tenant = ? AND user_id = ?", (tenant, user_id)
+            ).fetchone()
+            number = (last or 0) + 1
+            cursor = self.db.execute(
+                "INSERT INTO history (tenant, user_id, number, session, time, command, exit_code, cwd, "
+                "output_chars, output) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (tenant, user_id, number, session, time, command, exit_code, cwd, len(output), compressed)
+            )
+            self.db.execute("INSERT INTO history_fts (rowid, command, output) VALUES (?, ?, ?)",
+                            (cursor.lastrowid, command, kept))
+            if number > self.max_entries and number % PRUNE_EVERY == 0:
+                self._prune(tenant, user_id, number - self.max_entries)
+        return number
+
+    def _prune(self, tenant, user_id, up_to):
+        rows = self.db.execute(
+            "SELECT id, command, output FROM history WHERE tenant = ? AND user_id = ? AND number <= ?",
+            (tenant, user_id, up_to)
+        ).fetchall()
+        # A contentless index forgets a row only when given its original text
+        self.db.executemany(
+            "INSERT INTO history_fts (history_fts, rowid, command, output) VALUES ('delete', ?, ?, ?)",
+            [(row_id, command, _decompress(output)) for row_id, command, output in rows]
+        )
+        self.db.executemany("DELETE FROM history WHERE id = ?", [(row_id,) for row_id, _, _ in rows])
+
+    def recent(self, tenant, user_id, limit=20, session=None):
+        """Newest commands of a user, or of one session, oldest first and without outputs"""
+        query = ("SELECT number, session, time, command, exit_code, cwd, output_chars FROM history "
+                 "WHERE tenant = ? AND user_id = ?")
+        params = [tenant, user_id]
+        if session is not None:
+            query += " AND session = ?"
+            params.append(session)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY number DESC LIMIT ?", params + [limit]).fetchall()
+        return [_entry(row) for row in reversed(rows)]
+
+    def get(self, tenant, user_id, number=None, with_output=True):
+        """One entry with its stored output, the newest when number is None"""
+        columns = "number, session, time, command, exit_code, cwd, output_chars" + (", output" if with_output else "")
+        with self.lock:
+            if number is None:
+                row = self.db.execute(
+                    f"SELECT {columns} FROM history WHERE tenant = ? AND user_id = ? ORDER BY number DESC LIMIT 1",
+                    (tenant, user_id)
+                ).fetchone()
+            else:
+                row = self.db.execute(
+                    f"SELECT {columns} FROM history WHERE tenant = ? AND user_id = ? AND number = ?",
+                    (tenant, user_id, number)
+                ).fetchone()
+        return _entry(row) if row else None
+
+    def search(self, tenant, user_id, pattern, limit=10, lines_per_entry=3):
+        """Newest entries whose command or output contains pattern (case-insensitive).
+
+        Each entry carries 'lines', up to lines_per_entry matching output
+        lines; nothing is run on the remote host.
+        """
+        columns = "number, session, time, command, exit_code, cwd, output_chars, output"
+        with self.lock:
+            if len(pattern) >= MIN_INDEXED_PATTERN:
+                phrase = '"' + pattern.replace('"', '""') + '"'
+                rows = self.db.execute(
+                    f"SELECT {columns} FROM history WHERE tenant = ? AND user_id = ? AND id IN "
+                    f"(SELECT rowid FROM history_fts WHERE history_fts MATCH ?) ORDER BY number DESC LIMIT ?",
+                    (tenant, user_id, phrase, limit)
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    f"SELECT {columns} FROM history WHERE tenant = ? AND user_id = ? ORDER BY number DESC LIMIT ?",
+                    (tenant, user_id, SCAN_LIMIT)
+                ).fetchall()
+
+        needle = pattern.lower()
+        results = []
+        for row in rows:
+            entry = _entry(row)
+            entry['lines'] = [line for line in entry['output'].splitlines() if needle in line.lower()]
+            entry['lines'] = entry['lines'][:lines_per_entry]
+            if entry['lines'] or needle in entry['command'].lower():
+                results.append(entry)
+            if len(results) == limit:
+                break
+        return results
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def _decompress(data):
+    return zlib.decompress(data).decode('utf-8', errors='replace')
+
+
+def _entry(row):
+    number, session, time, command, exit_code, cwd, output_chars = row[:7]
+    entry = {
+        'number': number,
+        'session': session,
+        'time': time,
+        'command': command,
+        'exit_code': exit_code,
+        'cwd': cwd,
+        'output_chars': output_chars
+    }
+    if len(row) > 7:
+        entry['output'] = _decompress(row[7])
+    return entry
@@ -1,40 +1,70 @@
 import requests
+import hashlib
 import json
 import os
 import time
 from typing import Optional, Dict
 
+REQUIRED_FIELDS = ['botToken', 'chatId', 'sshHost', 'sshUsername']
+
+# 웹 설정에 hostGroups가 없을 때 쓰는 실행 환경의 호스트 그룹 (set_env_vars 전에 읽어 둠)
+HOST_GROUPS_ENV = os.getenv('HOST_GROUPS', '')
+
 class WebConfigLoader:
-    def __init__(self, web_url: str, password: str):
+    def __init__(self, web_url: str, password: str, snapshot_path: Optional[str] = None):
         self.web_url = web_url
         self.password = password
+        self.snapshot_path = snapshot_path
         self.config_cache = None
+        self.bots_cache = []
         self.last_update = 0
         self.cache_ttl = 60  # 1분 캐시
+        
+        # 조건부 요청용 (변경이 없으면 304로 본문 없이 응답)
+        self.etag = None
+        self.last_modified = None
     
-    def get_config(self) -> Optional[Dict]:
+    def get_config(self, force: bool = False) -> Optional[Dict]:
         """웹페이지에서 봇 설정을 가져옵니다."""
         current_time = time.time()
         
         # 캐시된 설정이 있고 아직 유효하다면 반환
-        if (self.config_cache and 
+        if (not force and self.config_cache and 
             current_time - self.last_update < self.cache_ttl):
             return self.config_cache
         
+        headers = {}
+        if self.config_cache:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        
         try:
             # API에서 설정 가져오기
             response = requests.get(
                 f"{self.web_url}/api.php",
                 params={"password": self.password},
+                headers=headers,
                 timeout=10
             )
             
+            if response.status_code == 304:
+                # 변경 없음: 캐시(또는 스냅샷) 그대로 사용
+                self.last_update = current_time
+                return self.config_cache
+            
             if response.status_code == 200:
                 bots = response.json()
                 if bots and len(bots) > 0:
                     # 첫 번째 봇 설정 사용 (여러 봇이 있다면 ID로 선택 가능)
                     self.config_cache = bots[0]
+                    self.bots_cache = bots
                     self.last_update = current_time
+                    self.etag = response.headers.get('ETag')
+                    self.last_modified = response.headers.get('Last-Modified')
+                    if not self.missing_fields(self.config_cache):
+                        self.save_snapshot()
                     print(f"✅ Web config loaded: {self.config_cache.get('projectName', 'Unknown')}")
                     return self.config_cache
                 else:
@@ -48,9 +78,89 @@ class WebConfigLoader:
             print(f"❌ Error loading config from web: {e}")
             return None
     
-    def get_env_vars(self) -> Dict[str, str]:
+    def _snapshot_key(self) -> str:
+        # 다른 URL/비밀번호로 저장된 스냅샷은 사용하지 않음
+        return hashlib.sha256(f"{self.web_url}\n{self.password}".encode('utf-8')).hexdigest()
+    
+    def save_snapshot(self) -> bool:
+        """마지막으로 받은 정상 설정을 로컬 파일에 저장합니다 (권한 0600)."""
+        if not self.snapshot_path or not self.config_cache:
+            return False
+        
+        snapshot = {
+            'key': self._snapshot_key(),
+            'saved_at': time.time(),
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'config': self.config_cache,
+            'bots': self.bots_cache
+        }
+        
+        try:
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            # 임시 파일에 쓴 뒤 교체해서 중간에 죽어도 스냅샷이 깨지지 않게 함
+            temp_path = f"{self.snapshot_path}.tmp"
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(temp_path, self.snapshot_path)
+            return True
+        except OSError as e:
+            print(f"⚠️ Failed to save config snapshot: {e}")
+            return False
+    
+    def load_snapshot(self) -> Optional[Dict]:
+        """로컬 스냅샷에서 설정을 읽습니다. 네트워크 없이 바로 부팅할 수 있습니다."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable config snapshot: {e}")
+            return None
+        
+        config = snapshot.get('config')
+        if snapshot.get('key') != self._snapshot_key() or not config or self.missing_fields(config):
+            return None
+        
+        self.config_cache = config
+        self.bots_cache = snapshot.get('bots') or [config]
+        self.etag = snapshot.get('etag')
+        self.last_modified = snapshot.get('last_modified')
+        # 스냅샷은 오래됐을 수 있으므로 다음 get_config()에서 다시 확인
+        self.last_update = 0
+        
+        age = int(time.time() - snapshot.get('saved_at', 0))
+        print(f"💾 Config snapshot loaded: {config.get('projectName', 'Unknown')} ({age}s old)")
+        return config
+    
+    def refresh(self, force: bool = True) -> bool:
+        """웹 설정을 다시 확인합니다. 설정이 바뀌었으면 True를 반환합니다."""
+        previous = self.bots_cache
+        config = self.get_config(force=force)
+        return config is not None and self.bots_cache != previous
+    
+    def all_configs(self) -> list:
+        """마지막으로 받은 설정 중 필수 항목이 모두 있는 봇 설정 목록 (요청하지 않음)"""
+        return [bot for bot in self.bots_cache if not self.missing_fields(bot)]
+    
+    @staticmethod
+    def config_key(config: Dict) -> str:
+        """봇 설정을 구분하는 키 (id, 프로젝트 이름, 토큰의 봇 ID 순)"""
+        return str(config.get('id') or config.get('projectName') or config.get('botToken', '').split(':')[0])
+    
+    @staticmethod
+    def missing_fields(config: Dict) -> list:
+        return [field for field in REQUIRED_FIELDS if not config.get(field)]
+    
+    def get_env_vars(self, config: Optional[Dict] = None) -> Dict[str, str]:
         """봇 설정을 환경변수 형태로 반환합니다."""
-        config = self.get_config()
+        config = config or self.get_config()
         if not config:
             return {}
         
@@ -69,9 +179,10 @@ class WebConfigLoader:
             'SSH_USERNAME': config.get('sshUsername', ''),
             'SSH_PASSWORD': config.get('sshPassword', ''),
             'ALLOWED_USERS': config.get('chatId', ''),
-            'MAX_OUTPUT_LENGTH': '4000',
+            'MAX_OUTPUT_LENGTH': str(config.get('maxOutputLength') or 4000),
             'WORKING_DIR': config.get('workingDir', '/root'),
-            'CLAUDE_CODE_PATH': '/usr/local/bin/claude'
+            'CLAUDE_CODE_PATH': '/usr/local/bin/claude',
+            'HOST_GROUPS': format_host_groups(config.get('hostGroups')) or HOST_GROUPS_ENV
         }
         
         return env_vars
@@ -82,12 +193,7 @@ class WebConfigLoader:
         if not config:
             return False
         
-        required_fields = ['botToken', 'chatId', 'sshHost', 'sshUsername']
-        missing_fields = []
-        
-        for field in required_fields:
-            if not config.get(field):
-                missing_fields.append(field)
+        missing_fields = self.missing_fields(config)
         
         if missing_fields:
             print(f"❌ Missing required config fields: {missing_fields}")
@@ -96,18 +202,39 @@ class WebConfigLoader:
         return True
 
 # 웹 설정으로 환경변수 설정하는 함수
-def load_web_config_as_env(web_url: str, password: str) -> bool:
+def load_web_config_as_env(web_url: str, password: str,
+                           loader: Optional[WebConfigLoader] = None) -> bool:
     """웹 설정을 로드하여 환경변수로 설정합니다."""
-    loader = WebConfigLoader(web_url, password)
+    # 이미 설정을 받은 로더를 넘기면 다시 요청하지 않음
+    loader = loader or WebConfigLoader(web_url, password)
     
     if not loader.validate_config():
         return False
     
-    env_vars = loader.get_env_vars()
-    
-    # 환경변수로 설정
+    set_env_vars(loader.get_env_vars())
+    return True
+
+def format_host_groups(groups) -> str:
+    """{그룹: [호스트, ...]} 또는 {그룹: "h1,h2"} 형태를 'web=h1,h2;db=h3' 문자열로 변환합니다."""
+    if not groups:
+        return ''
+    if isinstance(groups, str):
+        return groups
+    return ';'.join(
+        f"{name}={hosts if isinstance(hosts, str) else ','.join(hosts)}"
+        for name, hosts in groups.items()
+    )
+
+def diff_env_vars(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, tuple]:
+    """바뀐 설정만 {키: (이전 값, 새 값)} 형태로 반환합니다."""
+    return {
+        key: (old.get(key), new.get(key))
+        for key in set(old) | set(new)
+        if old.get(key) != new.get(key)
+    }
+
+def set_env_vars(env_vars: Dict[str, str]):
+    """설정 값을 환경변수로 설정합니다."""
     for key, value in env_vars.items():
         os.environ[key] = str(value)
         print(f"🔧 Set {key}={value[:10]}{'...' if len(value) > 10 else ''}")
-    
-    return True
\ No newline at end of file
@@ -0,0 +1,102 @@
+import time
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parse_host_groups(spec):
+    """'web=web1,deploy@web2:2222;db=db1' -> {group: [(label, host, port, username or None)]}"""
+    groups = {}
+    for part in (spec or '').split(';'):
+        if '=' not in part:
+            continue
+        name, hosts = part.split('=', 1)
+        entries = []
+        for label in (host.strip() for host in hosts.split(',')):
+            if not label:
+                continue
+            username, _, address = label.rpartition('@')
+            host, _, port = address.partition(':')
+            entries.append((label, host, int(port) if port.isdigit() else 22, username or None))
+        if name.strip() and entries:
+            groups[name.strip()] = entries
+    return groups
+
+
+def fold_results(results):
+    """Group hosts with identical output and exit status, largest group first"""
+    folded = {}
+    for result in results:
+        key = (result['output'], result['exit_code'], result['error'])
+        folded.setdefault(key, []).append(result)
+    return sorted(folded.values(), key=len, reverse=True)
+
+
+class FanoutRunner:
+    """Runs one command on many hosts in parallel over pooled SSH transports.
+
+    At most `max_parallel` hosts run at a time (shared by all callers), and
+    each host gets `timeout` seconds from the moment it starts; a host that
+    does not finish in time is reported as timed out and its channel is
+    closed. Output is kept up to `max_output_bytes` per host. The total
+    time of a run is about that of the slowest host, not the sum.
+    """
+
+    def __init__(self, pool, max_parallel=16, timeout=30, max_output_bytes=64 * 1024):
+        self.pool = pool
+        self.max_parallel = max_parallel
+        self.timeout = timeout
+        self.max_output_bytes = max_output_bytes
+        self.executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='fanout')
+
+    def run(self, hosts, command, username, password=''):
+        """Blocking: run command on [(label, host, port, username)], returns results in host order"""
+        futures = [self.executor.submit(self._run_host, entry, command, username, password) for entry in hosts]
+        return [future.result() for future in futures]
+
+    def _run_host(self, entry, command, username, password):
+        label, host, port, host_username = entry
+        started = time.monotonic()
+        deadline = started + self.timeout
+        result = {'host': label, 'output': '', 'exit_code': None, 'error': None, 'elapsed': 0}
+
+        channel = None
+        broken = False
+        try:
+            channel = self.pool.open_session(host, port, host_username or username, password)
+            channel.set_combine_stderr(True)
+            channel.exec_command(command)
+
+            chunks = []
+            size = 0
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout()
+                channel.settimeout(remaining)
+                chunk = channel.recv(32768)
+                if not chunk:
+                    break
+                # Keep reading past the cap so the command is not blocked on a full window
+                if size < self.max_output_bytes:
+                    chunks.append(chunk[:self.max_output_bytes - size])
+                size += len(chunk)
+
+            output = b''.join(chunks).decode('utf-8', errors='replace')
+            if size > self.max_output_bytes:
+                output += f"\n... ({size - self.max_output_bytes} more bytes)"
+            result['output'] = output.rstrip('\n')
+            if channel.status_event.wait(max(0, deadline - time.monotonic())):
+                result['exit_code'] = channel.exit_status
+        except socket.timeout:
+            result['error'] = f"timed out after {self.timeout}s"
+        except Exception as e:
+            result['error'] = str(e) or type(e).__name__
+            broken = True
+        finally:
+            if channel is not None:
+                self.pool.release(channel, broken=broken)
+        result['elapsed'] = time.monotonic() - started
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,164 @@
+import os
+import gzip
+import stat
+import codecs
+import tempfile
+import posixpath
+from telegram import InputFile
+
+# SFTP read size; paramiko splits requests into 32 KB packets and keeps this many in flight
+CHUNK_SIZE = 256 * 1024
+PREFETCH_REQUESTS = 64
+# Text smaller than this is sent as is
+GZIP_MIN_BYTES = 1024
+# Level 1 keeps up with a fast link, higher levels save little more on logs
+GZIP_LEVEL = 1
+
+
+def resolve_remote_path(path, cwd):
+    """Remote path relative to the session directory, '~/x' stays relative to the SFTP home"""
+    path = path.strip()
+    if path == '~':
+        return '.'
+    if path.startswith('~/'):
+        return path[2:] or '.'
+    if posixpath.isabs(path) or not cwd:
+        return path
+    return posixpath.join(cwd, path)
+
+
+def looks_like_text(chunk):
+    """No NUL bytes and valid UTF-8, a multibyte character cut at the end is fine"""
+    if b'\0' in chunk:
+        return False
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(chunk)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+class StreamedInputFile(InputFile):
+    """InputFile that hands the open file to the HTTP client instead of reading it into memory"""
+
+    def __init__(self, fileobj, filename):
+        super().__init__(b'', filename=filename)
+        # httpx streams file objects in chunks and rewinds them on a retry
+        self.input_file_content = fileobj
+
+
+class RemoteUpload:
+    """Pipelined write of one remote file, fed chunk by chunk"""
+
+    def __init__(self, pool, sftp, remote, path):
+        self.pool = pool
+        self.sftp = sftp
+        self.remote = remote
+        self.path = path
+        self.bytes = 0
+
+    def write(self, chunk):
+        self.remote.write(chunk)
+        self.bytes += len(chunk)
+
+    def close(self):
+        """Wait for the server to acknowledge every write"""
+        try:
+            self.remote.close()
+        finally:
+            self.pool.release(self.sftp.get_channel())
+
+    def abort(self):
+        """Drop the partial file"""
+        for cleanup in (self.remote.close, lambda: self.sftp.remove(self.path)):
+            try:
+                cleanup()
+            except Exception:
+                pass
+        self.pool.release(self.sftp.get_channel())
+
+
+class FileTransfer:
+    """SFTP file transfer on the pooled transports of the interactive sessions.
+
+    fetch() reads a remote file with pipelined SFTP requests into a spool
+    file, gzipping text on the fly, so the bot's memory stays flat whatever
+    the file size; the spool file is then uploaded to Telegram with
+    StreamedInputFile. open_upload() returns a RemoteUpload with pipelined
+    writes, fed from a streamed Telegram download. `max_bytes` is the most
+    the Bot API accepts for an upload.
+    """
+
+    def __init__(self, pool, spool_dir='data/transfers', max_bytes=50 * 1024 * 1024):
+        self.pool = pool
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def fetch(self, host, port, username, password, path):
+        """Blocking: copy a remote file into the spool directory.
+
+        Returns {'path', 'filename', 'size', 'bytes', 'gzipped'}; the caller
+        removes 'path'. Raises OSError for missing files and directories and
+        RuntimeError when the file cannot be sent to Telegram.
+        """
+        sftp = self.pool.open_sftp(host, port, username, password)
+        spool = None
+        try:
+            attributes = sftp.stat(path)
+            if stat.S_ISDIR(attributes.st_mode):
+                raise IsADirectoryError(f"{path} is a directory")
+
+            with sftp.open(path, 'rb') as remote:
+                remote.prefetch(attributes.st_size, max_concurrent_requests=PREFETCH_REQUESTS)
+                first = remote.read(CHUNK_SIZE)
+                gzipped = attributes.st_size >= GZIP_MIN_BYTES and looks_like_text(first[:8192])
+                if not gzipped and attributes.st_size > self.max_bytes:
+                    raise RuntimeError(f"File is {attributes.st_size // (1024 * 1024)} MB, "
+                                       f"Telegram accepts up to {self.max_bytes // (1024 * 1024)} MB")
+
+                spool = tempfile.NamedTemporaryFile(dir=self.spool_dir, delete=False)
+                sink = gzip.GzipFile(fileobj=spool, mode='wb', compresslevel=GZIP_LEVEL) if gzipped else spool
+                chunk = first
+                while chunk:
+                    sink.write(chunk)
+                    if spool.tell() > self.max_bytes:
+                        raise RuntimeError(f"File does not fit in {self.max_bytes // (1024 * 1024)} MB "
+                                           f"even compressed")
+                    chunk = remote.read(CHUNK_SIZE)
+                if gzipped:
+                    sink.close()
+                spool.close()
+        except BaseException:
+            if spool is not None:
+                spool.close()
+                os.remove(spool.name)
+            raise
+        finally:
+            self.pool.release(sftp.get_channel())
+
+        filename = posixpath.basename(path.rstrip('/')) or 'file'
+        return {
+            'path': spool.name,
+            'filename': filename + '.gz' if gzipped else filename,
+            'size': attributes.st_size,
+            'bytes': os.path.getsize(spool.name),
+            'gzipped': gzipped
+        }
+
+    def open_upload(self, host, port, username, password, path, filename):
+        """Blocking: open a remote file for writing, into `path` itself or the directory it names"""
+        sftp = self.pool.open_sftp(host, port, username, password)
+        try:
+            try:
+                if stat.S_ISDIR(sftp.stat(path).st_mode):
+                    path = posixpath.join(path, filename)
+            except FileNotFoundError:
+                pass
+            remote = sftp.open(path, 'wb')
+            # Writes do not wait for the server's status, close() collects them
+            remote.set_pipelined(True)
+        except BaseException:
+            self.pool.release(sftp.get_channel())
+            raise
+        return RemoteUpload(self.pool, sftp, remote, path)
@@ -0,0 +1,158 @@
+import time
+import asyncio
+from telegram.error import BadRequest, RetryAfter
+from metrics import Metrics
+
+# Telegram rejects messages longer than this
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class MessageStream:
+    """Live view of a running command, edited in place as output arrives.
+
+    Output is fed from the SSH worker thread, coalesced, and flushed to
+    Telegram at most once per `interval` seconds. When the text outgrows a
+    message the stream rolls over to a new one, up to `max_messages`; after
+    that the last message shows the tail of the output. With a `screen`, a
+    command that redraws in place is shown as the rendered terminal screen
+    instead, and an edit is only sent when the screen changed.
+    """
+
+    def __init__(self, message, header, title='', interval=1.5, max_messages=5, screen=None, metrics=None):
+        self.message = message
+        self.header = header
+        self.title = title
+        self.interval = interval
+        self.max_messages = max_messages
+        self.screen = screen
+        self.metrics = metrics or Metrics()
+
+        self.loop = asyncio.get_running_loop()
+        self.current = ''
+        self.sent = []
+        self.rendered = {}
+        self.omitted = False
+        self.footer = ''
+        self.reply_markup = None
+        self.finished = False
+        self.wake = asyncio.Event()
+        self.done = asyncio.Event()
+        self.pump = None
+
+    async def start(self, placeholder='⏳ running...'):
+        """Send the placeholder message and start the flush loop"""
+        self.sent.append(await self.message.reply_text(
+            self._render(0, placeholder), parse_mode='Markdown'
+        ))
+        self.pump = asyncio.create_task(self._pump())
+
+    def feed(self, text):
+        """Thread-safe: queue decoded output from the SSH worker"""
+        self.loop.call_soon_threadsafe(self._append, text)
+
+    def _append(self, text):
+        self.current += text
+        self.wake.set()
+
+    async def finish(self, result, footer='', reply_markup=None):
+        """Flush the remaining output and the footer, then stop"""
+        if not self.current.strip() and not self.omitted and len(self.sent) == 1:
+            # Nothing was streamed (e.g. session errors), show the result text
+            self.current = result['output']
+        self.footer = footer
+        self.reply_markup = reply_markup
+        self.finished = True
+        self.done.set()
+        self.wake.set()
+        await self.pump
+
+    async def _pump(self):
+        while not self.finished:
+            await self.wake.wait()
+            self.wake.clear()
+            await self._flush()
+            # Coalesce whatever arrives during the interval into one edit
+            try:
+                await asyncio.wait_for(self.done.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        await self._flush()
+
+    def _budget(self):
+        return TELEGRAM_MESSAGE_LIMIT - len(self._render(len(self.sent) - 1, '')) - len(self.footer) - 64
+
+    async def _flush(self):
+        if self.screen is not None and self.screen.interactive:
+            await self._flush_screen()
+            return
+        # Roll over to new messages while the text does not fit. Output keeps
+        # arriving during the awaits, so only the part sent is cut from self.current
+        while len(self.current) > self._budget():
+            budget = self._budget()
+            text = self.current
+            if len(self.sent) >= self.max_messages:
+                text = text[-budget:]
+                self.current = text[text.find('\n') + 1:] if '\n' in text else text
+                self.omitted = True
+                break
+            split = text.rfind('\n', 0, budget)
+            if split <= 0:
+                split = budget
+            rest = text[split:]
+            consumed = len(text) - len(rest.lstrip('\n'))
+            await self._edit(len(self.sent) - 1, text[:split])
+            self.sent.append(await self._send(self._render(len(self.sent), '⏳')))
+            self.current = self.current[consumed:]
+
+        body = self.current
+        if self.omitted:
+            body = '... (earlier output omitted)\n' + body
+        if not self.finished:
+            body = body or '⏳ running...'
+        await self._edit(len(self.sent) - 1, body, self.footer if self.finished else '')
+
+    async def _flush_screen(self):
+        # The screen replaces the raw stream, which is mostly redraw noise
+        self.current = ''
+        budget = self._budget()
+        body = '\n'.join(self.screen.render())
+        if len(body) > budget:
+            body = body[-budget:]
+        await self._edit(len(self.sent) - 1, body or ' ', self.footer if self.finished else '')
+
+    def _render(self, index, body, footer=''):
+        # Only the first message carries the title and the command header
+        title = f"{self.title}\n" if self.title and index == 0 else ''
+        header = self.header if index == 0 else ''
+        lines = '\n'.join(part for part in (header, body.strip('\n')) if part)
+        return f"{title}```bash\n{lines}\n```{footer}"
+
+    async def _edit(self, index, body, footer=''):
+        started = time.perf_counter()
+        text = self._render(index, body, footer)
+        self.metrics.observe('stage_seconds', time.perf_counter() - started, stage='render')
+        markup = self.reply_markup if self.finished and index == len(self.sent) - 1 else None
+        if self.rendered.get(index) == (text, markup) or self.sent[index] is None:
+            return
+        self.rendered[index] = (text, markup)
+        if markup:
+            await self._call(self.sent[index].edit_text, text, reply_markup=markup)
+        else:
+            await self._call(self.sent[index].edit_text, text)
+
+    async def _send(self, text):
+        return await self._call(self.message.reply_text, text)
+
+    async def _call(self, method, text, **kwargs):
+        for _ in range(3):
+            try:
+                return await method(text, parse_mode='Markdown', **kwargs)
+            except RetryAfter as e:
+                # Flood control: wait exactly as long as Telegram asks
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    return None
+                # Output broke the Markdown, fall back to plain text
+                return await method(text, **kwargs)
+        return None
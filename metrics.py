@@ -0,0 +1,188 @@
+import time
+import bisect
+import threading
+from collections import deque
+
+# Histogram buckets in seconds, from a recv wakeup to a long command
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Counter:
+    """Monotonic total plus per-second counts of the last minute for rates"""
+
+    def __init__(self):
+        self.value = 0
+        self.seconds = deque(maxlen=61)
+
+    def inc(self, amount, now):
+        self.value += amount
+        second = int(now)
+        if self.seconds and self.seconds[-1][0] == second:
+            self.seconds[-1][1] += amount
+        else:
+            self.seconds.append([second, amount])
+
+    def rate(self, now, window=60):
+        cutoff = int(now) - window
+        return sum(count for second, count in self.seconds if second > cutoff) / window
+
+
+class Histogram:
+    """Cumulative buckets for Prometheus and the latest `window` samples for percentiles"""
+
+    def __init__(self, window):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def percentiles(self, *points):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return [None] * len(points)
+        return [ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] for point in points]
+
+
+class Metrics:
+    """In-process counters, stage timers and gauges.
+
+    Recording is a dict lookup and a few additions under one lock, cheap
+    enough for every command and every Bot API call. Names are reported
+    with a `prefix`; labels are keyword arguments. Gauges are callbacks
+    read only when metrics are rendered, so they cost nothing in between.
+    Percentiles come from the latest `window` samples of each series.
+    """
+
+    def __init__(self, prefix='devbot', window=1024):
+        self.prefix = prefix
+        self.window = window
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None:
+                counter = self.counters[key] = Counter()
+            counter.inc(amount, time.time())
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.window)
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager observing the elapsed seconds of its block"""
+        return _Timer(self, name, labels)
+
+    def add_gauge(self, name, read):
+        """read() returns a number, or {((label, value), ...): number} for a labelled gauge"""
+        self.gauges[name] = read
+
+    def total(self, name, **labels):
+        with self.lock:
+            counter = self.counters.get((name, tuple(sorted(labels.items()))))
+            return counter.value if counter else 0
+
+    def rate(self, name, window=60):
+        """Per-second rate of a counter over the last window seconds, summed over labels"""
+        now = time.time()
+        with self.lock:
+            return sum(counter.rate(now, window) for (counter_name, _), counter in self.counters.items()
+                       if counter_name == name)
+
+    def stages(self, name):
+        """{label tuple: (count, p50, p95, p99)} of a histogram"""
+        with self.lock:
+            return {
+                labels: (histogram.count, *histogram.percentiles(50, 95, 99))
+                for (histogram_name, labels), histogram in sorted(self.histograms.items())
+                if histogram_name == name
+            }
+
+    def read_gauges(self):
+        values = {}
+        for name, read in list(self.gauges.items()):
+            try:
+                values[name] = read()
+            except Exception as e:
+                print(f"⚠️ Gauge {name} failed: {e}")
+        return values
+
+    def render_prometheus(self):
+        """Text exposition format (version 0.0.4)"""
+        lines = []
+        with self.lock:
+            counters = sorted((key, counter.value) for key, counter in self.counters.items())
+            histograms = sorted(
+                (key, list(histogram.counts), histogram.count, histogram.sum)
+                for key, histogram in self.histograms.items()
+            )
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+
+        for (name, labels), counts, count, total in histograms:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+
+        for name, value in sorted(self.read_gauges().items()):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            if isinstance(value, dict):
+                for labels, number in sorted(value.items()):
+                    lines.append(f"{metric}{_labels(labels)} {number}")
+            else:
+                lines.append(f"{metric} {value}")
+
+        lines.append(f"# TYPE {self.prefix}_uptime_seconds gauge")
+        lines.append(f"{self.prefix}_uptime_seconds {time.time() - self.started:.0f}")
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
@@ -0,0 +1,213 @@
+import time
+import heapq
+import asyncio
+import itertools
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from message_stream import TELEGRAM_MESSAGE_LIMIT
+from metrics import Metrics
+
+# Lower value goes first when the global bucket is empty
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available, without taking it"""
+        now = time.monotonic()
+        self._refill(now)
+        missing = max(0, (1 - self.tokens) / self.rate)
+        return max(missing, self.paused_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def reserve(self):
+        """Take a token now, on credit if there is none; returns how long to wait before using it"""
+        wait = self.wait_time()
+        self.tokens -= 1
+        if self.tokens < 0:
+            wait = max(wait, -self.tokens / self.rate)
+        return wait
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self):
+        return self.wait_time() == 0 and self.tokens >= self.capacity
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Central dispatcher for every Bot API call of one bot.
+
+    Requests carrying a chat_id wait for a token of that chat (`chat_rate`
+    per second with bursts of `chat_burst`, `group_rate` per minute for
+    groups and channels), then for a token of the bot-wide bucket
+    (`global_rate` per second). When the global bucket is empty, waiting
+    interactive requests are let through before background ones, so a
+    burst of reminders cannot delay command replies. A RetryAfter pauses
+    the affected chat for the delay Telegram asks for and the request is
+    retried. sendMessage calls passed rate_limit_args={'merge': True} are
+    folded into a still queued message to the same chat when the result
+    fits in one message; all callers get that message back.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, group_rate=20, max_retries=3, metrics=None):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.metrics = metrics or Metrics()
+
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chats = {}
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.mergeable = {}
+        self.wake = None
+        self.dispatcher = None
+
+    async def initialize(self):
+        self.wake = asyncio.Event()
+        self.dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            self.dispatcher = None
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        options = rate_limit_args or {}
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            # Callback answers, webhook setup and the like count against no chat
+            return await callback(*args, **kwargs)
+
+        priority = options.get('priority', PRIORITY_INTERACTIVE)
+        merge = options.get('merge') and endpoint == 'sendMessage' and 'reply_markup' not in data
+        if merge:
+            pending = self._merge_into_pending(chat_id, data)
+            if pending is not None:
+                self.metrics.inc('telegram_merged_total')
+                return await asyncio.shield(pending)
+
+        entry = None
+        if merge:
+            entry = (data, asyncio.get_running_loop().create_future())
+            self.mergeable[chat_id] = entry
+        try:
+            result = await self._send(callback, args, kwargs, endpoint, chat_id, priority, entry)
+        except asyncio.CancelledError:
+            if entry is not None:
+                entry[1].cancel()
+            raise
+        except Exception as e:
+            if entry is not None:
+                entry[1].set_exception(e)
+                # Merged callers may be gone, the owner reports the error anyway
+                entry[1].exception()
+            raise
+        finally:
+            if entry is not None and self.mergeable.get(chat_id) is entry:
+                del self.mergeable[chat_id]
+        if entry is not None:
+            entry[1].set_result(result)
+        return result
+
+    async def _send(self, callback, args, kwargs, endpoint, chat_id, priority, entry):
+        bucket = self._chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            queued = time.perf_counter()
+            delay = bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            await self._acquire_global(priority)
+            started = time.perf_counter()
+            self.metrics.observe('stage_seconds', started - queued, stage='telegram_wait')
+
+            # Too late to fold more text into this one
+            if entry is not None and self.mergeable.get(chat_id) is entry:
+                del self.mergeable[chat_id]
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.metrics.inc('telegram_retry_after_total')
+                print(f"⏳ Flood control on chat {chat_id}, retrying in {e.retry_after}s")
+                bucket.pause(e.retry_after)
+                continue
+            finally:
+                self.metrics.observe('stage_seconds', time.perf_counter() - started, stage='telegram_api')
+                self.metrics.inc('telegram_requests_total', endpoint=endpoint)
+            return result
+
+    def _merge_into_pending(self, chat_id, data):
+        """Append the text to a queued message of the chat, returns its future or None"""
+        entry = self.mergeable.get(chat_id)
+        if entry is None:
+            return None
+        pending, future = entry
+        if pending.get('parse_mode') != data.get('parse_mode'):
+            return None
+        text = f"{pending['text']}\n\n{data['text']}"
+        if len(text) > TELEGRAM_MESSAGE_LIMIT:
+            return None
+        pending['text'] = text
+        return future
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) > 10000:
+                # Forget chats whose bucket is full again, they start full anyway
+                self.chats = {key: value for key, value in self.chats.items() if not value.idle}
+            group = isinstance(chat_id, str) or chat_id < 0
+            if group:
+                bucket = TokenBucket(self.group_rate / 60, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire_global(self, priority):
+        if self.dispatcher is None:
+            # Used without initialize(), e.g. by a bot that was never started
+            await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.sequence), future))
+        self.wake.set()
+        await future
+
+    async def _dispatch(self):
+        """Hand out global tokens to the waiting requests in priority order"""
+        while True:
+            while self.waiting and self.waiting[0][2].done():
+                # Cancelled while waiting
+                heapq.heappop(self.waiting)
+            if not self.waiting:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            wait = self.global_bucket.wait_time()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            self.global_bucket.take()
+            heapq.heappop(self.waiting)[2].set_result(None)
@@ -0,0 +1,130 @@
+import re
+import codecs
+from collections import deque
+
+# Printed after every command so we know exactly when it finished, how, and where
+MARKER_PREFIX = '__DEVBOT_DONE_'
+MARKER_PATTERN = re.compile(r'\r?\n?' + MARKER_PREFIX + r'([0-9a-f]+)_(\d+):[^\r\n]*__\r?\n?')
+STALE_MARKER_PATTERN = re.compile(MARKER_PATTERN.pattern.encode('ascii'))
+
+# CSI sequences, OSC sequences (title changes etc.) and two-byte escapes
+ANSI_PATTERN = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])')
+
+# Hard cap on characters kept per command, the middle is dropped beyond this
+MAX_CAPTURE_CHARS = 8 * 1024 * 1024
+
+
+class OutputReader:
+    """Incremental reader for one command's output on the shell channel.
+
+    Raw bytes go into a bytearray that only ever holds data not yet decoded
+    (at most a partially received end marker), so reading is linear in the
+    output size. Decoding uses an incremental UTF-8 decoder, so multibyte
+    characters split across recv() chunks are reassembled instead of raising,
+    and ANSI escapes are stripped in the same pass, holding back an escape
+    sequence that is cut off at the end of a chunk. `raw_sink` receives the
+    decoded text before stripping, e.g. to drive a terminal screen model.
+    """
+
+    def __init__(self, token, strip_ansi=True, max_chars=MAX_CAPTURE_CHARS, raw_sink=None):
+        self.done = re.compile(re.escape(f'{MARKER_PREFIX}{token}_'.encode('ascii')) + rb'(\d+):([^\r\n]*)__\r?\n')
+        self.prefix = MARKER_PREFIX.encode('ascii')
+        self.strip_ansi = strip_ansi
+        self.max_chars = max_chars
+        self.raw_sink = raw_sink
+
+        self.buffer = bytearray()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.pending = ''
+        self.head = []
+        self.head_size = 0
+        self.tail = deque()
+        self.tail_size = 0
+        self.omitted = 0
+
+        self.finished = False
+        self.exit_code = None
+        self.cwd = None
+
+    def feed(self, chunk):
+        """Add received bytes, returns the newly decoded text (may be empty)"""
+        self.buffer += chunk
+        match = self.done.search(self.buffer)
+        if match:
+            self.finished = True
+            self.exit_code = int(match.group(1))
+            self.cwd = match.group(2).decode('utf-8', errors='replace')
+            return self._consume(match.start(), final=True)
+        return self._consume(self._safe_length(), final=False)
+
+    def flush(self):
+        """Decode everything left, used when giving up on the marker"""
+        return self._consume(len(self.buffer), final=True)
+
+    def text(self):
+        """Full decoded output (head and tail if it exceeded max_chars)"""
+        parts = self.head
+        if self.omitted:
+            parts = parts + [f"\n... ({self.omitted} characters omitted) ...\n"]
+        text = ''.join(parts + list(self.tail)).strip('\n')
+        if '\r' in text:
+            # Progress bars redraw a line with \r, keep only what was left on it
+            text = '\n'.join(line.rstrip('\r').rsplit('\r', 1)[-1] for line in text.split('\n'))
+        return text
+
+    def _safe_length(self):
+        """Bytes that cannot be the start of a partially received marker"""
+        index = self.buffer.find(self.prefix)
+        while index >= 0:
+            # A complete line is a stale marker from an earlier timeout, ours ends the read
+            end = self.buffer.find(b'\n', index)
+            if end < 0:
+                return index
+            index = self.buffer.find(self.prefix, end)
+        # Hold back a tail that could still grow into the marker prefix
+        start = len(self.buffer) - len(self.prefix) + 1
+        index = self.buffer.find(b'_', max(0, start))
+        while index >= 0:
+            if self.prefix.startswith(self.buffer[index:]):
+                return index
+            index = self.buffer.find(b'_', index + 1)
+        return len(self.buffer)
+
+    def _consume(self, length, final):
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        if self.prefix in data:
+            data = STALE_MARKER_PATTERN.sub(b'\n', data)
+
+        text = self.pending + self.decoder.decode(data, final)
+        self.pending = ''
+        if not final:
+            # Hold back a cut-off escape sequence or a \r that may start \r\n
+            cut = len(text)
+            escape = text.rfind('\x1b', max(0, len(text) - 64))
+            if escape >= 0 and not ANSI_PATTERN.match(text, escape):
+                cut = escape
+            if cut and text[cut - 1] == '\r':
+                cut -= 1
+            text, self.pending = text[:cut], text[cut:]
+
+        if self.raw_sink and text:
+            self.raw_sink(text)
+        if self.strip_ansi and '\x1b' in text:
+            text = ANSI_PATTERN.sub('', text)
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+        self._store(text)
+        return text
+
+    def _store(self, text):
+        if self.head_size < self.max_chars // 2:
+            self.head.append(text)
+            self.head_size += len(text)
+            return
+        self.tail.append(text)
+        self.tail_size += len(text)
+        while self.tail_size > self.max_chars // 2 and len(self.tail) > 1:
+            dropped = self.tail.popleft()
+            self.tail_size -= len(dropped)
+            self.omitted += len(dropped)
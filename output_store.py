@@ -0,0 +1,155 @@
+import os
+import mmap
+import time
+import uuid
+import zlib
+import threading
+from collections import OrderedDict
+
+
+class OutputStore:
+    """Full command outputs kept for paging and download, bounded by size and age.
+
+    Outputs are stored as UTF-8 and split into pages on line boundaries when
+    they are added. Small outputs live zlib-compressed in memory; outputs
+    larger than `spill_bytes` are written to `spill_dir` and pages are read
+    through mmap, so browsing a large log never loads all of it. The oldest
+    entries are evicted once the memory or disk budget is exceeded or they are
+    older than `max_age` seconds.
+    """
+
+    def __init__(self, page_size=3500, max_memory_bytes=16 * 1024 * 1024,
+                 max_disk_bytes=256 * 1024 * 1024, max_age=3600,
+                 spill_bytes=512 * 1024, spill_dir='logs/outputs'):
+        self.page_size = page_size
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+
+    def put(self, user_id, command, text, exit_code=None, page_size=None):
+        """Store an output and return its id, page_size overrides the default"""
+        data = text.encode('utf-8')
+        output_id = uuid.uuid4().hex[:10]
+        entry = {
+            'user_id': user_id,
+            'command': command,
+            'exit_code': exit_code,
+            'created': time.time(),
+            'size': len(data),
+            'pages': self._paginate(data, page_size or self.page_size),
+            'blob': None,
+            'path': None
+        }
+
+        if len(data) > self.spill_bytes:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            entry['path'] = os.path.join(self.spill_dir, f'{output_id}.txt')
+            with open(entry['path'], 'wb') as f:
+                f.write(data)
+        else:
+            entry['blob'] = zlib.compress(data, 6)
+
+        with self.lock:
+            self.entries[output_id] = entry
+            if entry['path']:
+                self.disk_bytes += entry['size']
+            else:
+                self.memory_bytes += len(entry['blob'])
+            self._evict()
+        return output_id
+
+    def page_count(self, output_id):
+        with self.lock:
+            entry = self.entries.get(output_id)
+            return len(entry['pages']) if entry else 0
+
+    def get_page(self, output_id, page):
+        """Returns (entry info, page text, page count) or None when evicted"""
+        with self.lock:
+            self._evict()
+            entry = self.entries.get(output_id)
+            if entry is None:
+                return None
+            page = max(0, min(page, len(entry['pages']) - 1))
+            start, end = entry['pages'][page]
+
+            if entry['path']:
+                with open(entry['path'], 'rb') as f, \
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    data = view[start:end]
+            else:
+                data = zlib.decompress(entry['blob'])[start:end]
+
+            info = {key: entry[key] for key in ('user_id', 'command', 'exit_code', 'size')}
+            return info, data.decode('utf-8', errors='replace'), len(entry['pages'])
+
+    def get_document(self, output_id):
+        """Returns (entry info, full output bytes) or None when evicted"""
+        with self.lock:
+            entry = self.entries.get(output_id)
+            if entry is None:
+                return None
+            if entry['path']:
+                with open(entry['path'], 'rb') as f:
+                    data = f.read()
+            else:
+                data = zlib.decompress(entry['blob'])
+            info = {key: entry[key] for key in ('user_id', 'command', 'exit_code', 'size')}
+            return info, data
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'memory_bytes': self.memory_bytes,
+                'disk_bytes': self.disk_bytes
+            }
+
+    def _paginate(self, data, page_size):
+        """Byte ranges of pages, split after newlines and never inside a UTF-8 character"""
+        pages = []
+        start = 0
+        while start < len(data):
+            end = start + page_size
+            if end >= len(data):
+                end = len(data)
+            else:
+                newline = data.rfind(b'\n', start, end)
+                if newline > start:
+                    end = newline + 1
+                else:
+                    # One long line: step back off UTF-8 continuation bytes
+                    while end > start + 1 and (data[end] & 0xC0) == 0x80:
+                        end -= 1
+            pages.append((start, end))
+            start = end
+        return pages or [(0, 0)]
+
+    def _evict(self):
+        """Drop expired entries, then the oldest ones while over budget (lock held)"""
+        now = time.time()
+        for output_id in [i for i, entry in self.entries.items() if now - entry['created'] > self.max_age]:
+            self._remove(output_id)
+
+        while self.memory_bytes > self.max_memory_bytes:
+            self._remove(next(i for i, entry in self.entries.items() if entry['path'] is None))
+        while self.disk_bytes > self.max_disk_bytes:
+            self._remove(next(i for i, entry in self.entries.items() if entry['path'] is not None))
+
+    def _remove(self, output_id):
+        entry = self.entries.pop(output_id)
+        if entry['path']:
+            self.disk_bytes -= entry['size']
+            try:
+                os.remove(entry['path'])
+            except OSError:
+                pass
+        else:
+            self.memory_bytes -= len(entry['blob'])
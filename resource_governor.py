@@ -0,0 +1,98 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class ResourceGovernor:
+    """Bounds the SSH channels held open for sessions, process-wide and per user.
+
+    Interactive shells are kept in LRU order. Opening a shell beyond
+    `max_shells` (all tenants) or `max_user_channels` (shells plus background
+    jobs of one user) first hibernates the least recently used idle shell:
+    its channel is closed but the session keeps cwd, env and counters, and
+    the next command reopens it through the normal reconnect path. reap()
+    hibernates shells idle for longer than `idle_timeout` seconds, so
+    abandoned sessions stop costing a remote shell and a file descriptor.
+    """
+
+    def __init__(self, max_shells=200, max_user_channels=4, idle_timeout=1800):
+        self.max_shells = max_shells
+        self.max_user_channels = max_user_channels
+        self.idle_timeout = idle_timeout
+
+        self.lock = threading.Lock()
+        self.shells = OrderedDict()
+        self.jobs = {}
+        self.hibernated = 0
+
+    def reserve_shell(self, manager, user_id):
+        """Make room for a shell of (manager, user_id), raises RuntimeError if everything is busy"""
+        key = (manager, user_id)
+        while True:
+            with self.lock:
+                self.shells.pop(key, None)
+                user_over = self.max_user_channels and self._user_channels(user_id) >= self.max_user_channels
+                global_over = self.max_shells and len(self.shells) >= self.max_shells
+                if not user_over and not global_over:
+                    self.shells[key] = time.time()
+                    return
+                candidates = [k for k in self.shells if not user_over or k[1] == user_id]
+
+            # Hibernate outside the lock, it waits for nothing but may close a channel
+            if not any(self._hibernate(candidate) for candidate in candidates):
+                scope = f"user {user_id}" if user_over else "the bot"
+                raise RuntimeError(f"Channel limit reached for {scope}, all sessions are busy")
+
+    def touch(self, manager, user_id):
+        with self.lock:
+            key = (manager, user_id)
+            if key in self.shells:
+                self.shells[key] = time.time()
+                self.shells.move_to_end(key)
+
+    def release_shell(self, manager, user_id):
+        with self.lock:
+            self.shells.pop((manager, user_id), None)
+
+    def acquire_job(self, user_id):
+        """Count a background job channel, raises RuntimeError over the per-user cap"""
+        with self.lock:
+            if self.max_user_channels and self._user_channels(user_id) >= self.max_user_channels:
+                raise RuntimeError(f"Channel limit reached ({self.max_user_channels} per user)")
+            self.jobs[user_id] = self.jobs.get(user_id, 0) + 1
+
+    def release_job(self, user_id):
+        with self.lock:
+            self.jobs[user_id] = max(0, self.jobs.get(user_id, 0) - 1)
+            if not self.jobs[user_id]:
+                del self.jobs[user_id]
+
+    def reap(self):
+        """Hibernate shells idle for longer than idle_timeout, returns how many"""
+        if not self.idle_timeout:
+            return 0
+        cutoff = time.time() - self.idle_timeout
+        with self.lock:
+            idle = [key for key, last_used in self.shells.items() if last_used < cutoff]
+        return sum(1 for key in idle if self._hibernate(key))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'shells': len(self.shells),
+                'job_channels': sum(self.jobs.values()),
+                'hibernated': self.hibernated
+            }
+
+    def _user_channels(self, user_id):
+        """Lock held"""
+        return sum(1 for _, owner in self.shells if owner == user_id) + self.jobs.get(user_id, 0)
+
+    def _hibernate(self, key):
+        manager, user_id = key
+        if not manager.hibernate(user_id):
+            return False
+        with self.lock:
+            self.shells.pop(key, None)
+            self.hibernated += 1
+        return True
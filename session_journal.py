@@ -0,0 +1,83 @@
+import os
+import json
+import sqlite3
+import threading
+
+
+class SessionJournal:
+    """Crash-safe record of open sessions in SQLite (WAL mode).
+
+    One row per (tenant, user) holds what is needed to bring a session back
+    after a restart: start time, counters, cwd, exported env and the reminder
+    interval. Rows are upserted after every command, so the file stays as
+    small as the number of open sessions. WAL with synchronous=NORMAL keeps a
+    write to one small transaction that survives a process crash. The file
+    can hold exported secrets, so it is created with mode 0600.
+    """
+
+    def __init__(self, path='data/sessions.db'):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+
+        self.lock = threading.Lock()
+        # Written from the SSH worker threads, serialized by self.lock
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                tenant TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                start_time REAL NOT NULL,
+                last_activity REAL NOT NULL,
+                commands_count INTEGER NOT NULL,
+                reconnects INTEGER NOT NULL,
+                current_dir TEXT NOT NULL,
+                env TEXT NOT NULL,
+                monitor_interval INTEGER,
+                PRIMARY KEY (tenant, user_id)
+            )
+        """)
+
+    def save(self, tenant, user_id, session, last_activity):
+        row = (
+            tenant, user_id, session['start_time'].timestamp(), last_activity,
+            session['commands_count'], session['reconnects'], session['current_dir'],
+            json.dumps(session['env']), session.get('monitor_interval')
+        )
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def delete(self, tenant, user_id):
+        with self.lock:
+            self.db.execute("DELETE FROM sessions WHERE tenant = ? AND user_id = ?", (tenant, user_id))
+
+    def load(self, tenant):
+        """Saved sessions of a tenant as dicts"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT user_id, start_time, last_activity, commands_count, reconnects, "
+                "current_dir, env, monitor_interval FROM sessions WHERE tenant = ?", (tenant,)
+            ).fetchall()
+        return [
+            {
+                'user_id': user_id,
+                'start_time': start_time,
+                'last_activity': last_activity,
+                'commands_count': commands_count,
+                'reconnects': reconnects,
+                'current_dir': current_dir,
+                'env': json.loads(env),
+                'monitor_interval': monitor_interval
+            }
+            for (user_id, start_time, last_activity, commands_count, reconnects,
+                 current_dir, env, monitor_interval) in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,622 @@
+import re
+import time
+import uuid
+import shlex
+import random
+import socket
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ssh_pool import SSHConnectionPool
+from output_reader import OutputReader, MARKER_PREFIX
+from terminal_screen import TerminalScreen
+from metrics import Metrics
+
+# Shell names that can be replayed with export NAME=value
+ENV_NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# Seconds a timed-out command gets to answer Ctrl-C before its shell is dropped
+INTERRUPT_GRACE = 5
+# After Ctrl-C the tty discards pending input, so the end marker is sent this
+# many seconds later and again every MARKER_RESEND seconds until it shows up
+INTERRUPT_SETTLE = 0.3
+MARKER_RESEND = 1.0
+
+
+# Session Management
+class SessionManager:
+    def __init__(self, ssh_host, ssh_port=22, ssh_username='root', ssh_password='',
+                 working_dir='/root', max_workers=16,
+                 command_timeout=300, pool=None, reconnect_attempts=5,
+                 reconnect_base_delay=0.5, reconnect_max_delay=10, max_queue_depth=5,
+                 screen_cols=80, screen_rows=24, journal=None, journal_key='default', governor=None,
+                 metrics=None, audit=None, history=None):
+        self.ssh_host = ssh_host
+        self.ssh_port = ssh_port
+        self.ssh_username = ssh_username
+        self.ssh_password = ssh_password
+        self.working_dir = working_dir
+        self.command_timeout = command_timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.max_queue_depth = max_queue_depth
+        self.screen_cols = screen_cols
+        self.screen_rows = screen_rows
+
+        # Optional SessionJournal, sessions survive restarts under journal_key
+        self.journal = journal
+        self.journal_key = journal_key
+
+        # Optional ResourceGovernor capping open shells, may hibernate idle sessions
+        self.governor = governor
+
+        # Shell channels are multiplexed over shared transports
+        self.pool = pool or SSHConnectionPool()
+
+        # Stage timers and counters, shared with the rest of the bot when given
+        self.metrics = metrics or Metrics()
+
+        # Optional AuditLog, every executed command is recorded under journal_key
+        self.audit = audit
+
+        # Optional CommandHistory behind /history, /grep and !n recall
+        self.history = history
+
+        self.sessions = {}
+        self.last_activity = {}
+        self.session_active = {}
+        self.command_locks = {}
+        self.queue_locks = {}
+        # Orders cancel() against sending a command, see _run_until_marker
+        self.cancel_lock = threading.Lock()
+        self.monitoring_thread = None
+
+        # Blocking paramiko calls run here so the event loop stays free
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ssh')
+
+    def create_session(self, user_id):
+        """Create a new persistent session"""
+        if user_id not in self.sessions:
+            self._add_session(user_id, datetime.now(), self.working_dir)
+
+            # Create SSH connection for this user
+            if self.connect_ssh(user_id):
+                self._journal_save(user_id)
+                return True
+        return False
+
+    def _add_session(self, user_id, start_time, current_dir, env=None):
+        self.sessions[user_id] = {
+            'start_time': start_time,
+            'commands_count': 0,
+            'current_dir': current_dir,
+            'env': env or {},
+            'reconnects': 0,
+            'running': None,
+            'pending': deque(),
+            'screen': TerminalScreen(self.screen_cols, self.screen_rows),
+            'monitor_interval': None
+        }
+        self.session_active[user_id] = True
+        self.last_activity[user_id] = time.time()
+        self.command_locks.setdefault(user_id, threading.Lock())
+        self.queue_locks[user_id] = asyncio.Lock()
+        return self.sessions[user_id]
+
+    def restore(self):
+        """Bring back journaled sessions without connecting, returns the restored records.
+
+        Only the bookkeeping is rebuilt here, so boot time does not grow with
+        the number of sessions. The shell is opened on the user's next
+        command by the usual reconnect path, which replays cwd and env.
+        """
+        if self.journal is None:
+            return []
+        restored = []
+        for record in self.journal.load(self.journal_key):
+            user_id = record['user_id']
+            if user_id in self.sessions:
+                continue
+            session = self._add_session(user_id, datetime.fromtimestamp(record['start_time']),
+                                        record['current_dir'], record['env'])
+            session['commands_count'] = record['commands_count']
+            session['reconnects'] = record['reconnects']
+            session['monitor_interval'] = record['monitor_interval']
+            self.last_activity[user_id] = record['last_activity']
+            restored.append(record)
+        return restored
+
+    def set_monitor(self, user_id, interval):
+        """Remember the reminder interval (None = off) so it is rescheduled after a restart"""
+        if user_id in self.sessions:
+            self.sessions[user_id]['monitor_interval'] = interval
+            self._journal_save(user_id)
+
+    def _journal_save(self, user_id):
+        if self.journal is None or user_id not in self.sessions:
+            return
+        try:
+            self.journal.save(self.journal_key, user_id, self.sessions[user_id], self.last_activity[user_id])
+        except Exception as e:
+            print(f"⚠️ Session journal write failed for user {user_id}: {e}")
+
+    def _history_add(self, user_id, session, command, output, exit_code):
+        if self.history is None:
+            return
+        try:
+            self.history.add(self.journal_key, user_id, self._session_id(session), command, output,
+                             exit_code, session['current_dir'], self.last_activity[user_id])
+        except Exception as e:
+            print(f"⚠️ Command history write failed for user {user_id}: {e}")
+
+    @staticmethod
+    def _session_id(session):
+        """Start time of a session, tells its commands apart from the user's earlier sessions"""
+        return session['start_time'].strftime('%Y%m%d-%H%M%S')
+
+    def get_history(self, user_id, limit=20, current_session=True):
+        """Newest commands of the user's current session, or of all their sessions"""
+        if self.history is None:
+            return []
+        session = self.sessions.get(user_id)
+        if current_session and session is None:
+            return []
+        return self.history.recent(self.journal_key, user_id, limit,
+                                   session=self._session_id(session) if current_session else None)
+
+    def get_history_entry(self, user_id, number=None, with_output=True):
+        """Command number n of the user with its saved output, the last one when number is None"""
+        if self.history is None:
+            return None
+        return self.history.get(self.journal_key, user_id, number, with_output)
+
+    def search_history(self, user_id, pattern, limit=10):
+        """Past commands and outputs of the user containing pattern, without running anything"""
+        if self.history is None:
+            return []
+        return self.history.search(self.journal_key, user_id, pattern, limit)
+
+    def connect_ssh(self, user_id):
+        """Establish SSH connection for a user"""
+        started = time.perf_counter()
+        try:
+            # Drop the previous channel first when reconnecting
+            old_shell = self.sessions[user_id].pop('shell', None)
+            if old_shell is not None:
+                self.pool.release(old_shell, broken=True)
+
+            # Make room under the channel caps, possibly hibernating someone idle
+            if self.governor is not None:
+                self.governor.reserve_shell(self, user_id)
+
+            # Open persistent shell channel
+            # The pty size matches the screen model so full-screen programs lay out for it
+            shell = self.pool.open_shell(self.ssh_host, self.ssh_port, self.ssh_username, self.ssh_password,
+                                         width=self.screen_cols, height=self.screen_rows)
+            self.sessions[user_id]['shell'] = shell
+
+            # Quiet shell: no echo or prompts, so output is only what commands print.
+            # Waiting for the marker also drains the login banner.
+            shell.send("stty -echo; PS1=''; PS2=''; PROMPT_COMMAND=''; bind 'set enable-bracketed-paste off' 2>/dev/null\n")
+
+            # Replay the tracked state so a reconnect lands where the user left off
+            session = self.sessions[user_id]
+            setup = [f'export {name}={shlex.quote(value)}' for name, value in session['env'].items()]
+            setup.append(f"cd {shlex.quote(session['current_dir'])} 2>/dev/null || cd {shlex.quote(self.working_dir)}")
+            _, _, cwd = self._run_until_marker(shell, '; '.join(setup), timeout=10)
+            if cwd:
+                session['current_dir'] = cwd
+
+            self.metrics.observe('stage_seconds', time.perf_counter() - started, stage='ssh_connect')
+            self.metrics.inc('ssh_connects_total')
+            return True
+        except Exception as e:
+            print(f"SSH connection error for user {user_id}: {e}")
+            self.metrics.inc('ssh_connect_failures_total')
+            if self.governor is not None:
+                self.governor.release_shell(self, user_id)
+            return False
+
+    def execute_command(self, user_id, command, on_output=None):
+        """Execute command in user's session, optionally streaming decoded output to on_output"""
+        if user_id not in self.session_active or not self.session_active[user_id]:
+            return {'output': "Session not active. Use /start to begin a new session.", 'exit_code': None}
+
+        # One command at a time per shell, otherwise outputs interleave
+        with self.command_locks[user_id]:
+            return self._execute_locked(user_id, command, on_output)
+
+    def _execute_locked(self, user_id, command, on_output=None):
+        self.last_activity[user_id] = time.time()
+        session = self.sessions[user_id]
+        session['commands_count'] += 1
+        self.metrics.inc('commands_total')
+
+        if self.governor is not None:
+            self.governor.touch(self, user_id)
+
+        # Hibernated or restored from the journal: open the shell now
+        if 'shell' not in session and not session.get('retarget'):
+            if self.connect_ssh(user_id):
+                print(f"▶️ Resumed session for user {user_id}")
+            elif not self._reconnect(user_id):
+                return {'output': "Session error: SSH connection lost and reconnect failed", 'exit_code': None}
+
+        # SSH settings changed since this shell was opened: move it between commands
+        if session.pop('retarget', False):
+            print(f"🔀 Moving session for user {user_id} to {self.ssh_username}@{self.ssh_host}:{self.ssh_port}")
+            if not self._reconnect(user_id):
+                return {'output': "Session error: could not connect to the new SSH target", 'exit_code': None}
+
+        # Catch dead links before sending, so the command is never lost halfway
+        if not self._shell_alive(session.get('shell')) and not self._reconnect(user_id):
+            return {'output': "Session error: SSH connection lost and reconnect failed", 'exit_code': None}
+
+        try:
+            with self.metrics.timer('stage_seconds', stage='command'):
+                output, exit_code, cwd = self._run_until_marker(
+                    session['shell'], command, self.command_timeout, on_output, session
+                )
+        except Exception as e:
+            # The command may already have run, so restore the session but don't re-run it
+            restored = self._reconnect(user_id)
+            status = "session restored, please retry" if restored else "reconnect failed"
+            return {'output': f"Session error: {e} ({status})", 'exit_code': None}
+        if output is None:
+            return {'output': "Command cancelled before it started", 'exit_code': None}
+
+        if cwd:
+            session['current_dir'] = cwd
+        self._track_env(session, command)
+
+        self._journal_save(user_id)
+
+        self._history_add(user_id, session, command, output, exit_code)
+
+        return {
+            'output': output if output else "Command executed (no output)",
+            'exit_code': exit_code
+        }
+
+    def retarget(self, ssh_host, ssh_port, ssh_username, ssh_password):
+        """Switch to new SSH settings without dropping sessions.
+
+        New sessions connect to the new target right away. Existing sessions
+        finish what they are running on the old shell and reconnect (with cwd
+        and env replayed) before their next command, so the switch is spread
+        over user activity instead of reconnecting everyone at once.
+        Returns the number of sessions that will move.
+        """
+        self.ssh_host = ssh_host
+        self.ssh_port = ssh_port
+        self.ssh_username = ssh_username
+        self.ssh_password = ssh_password
+
+        moved = 0
+        for user_id, session in list(self.sessions.items()):
+            if self.session_active.get(user_id):
+                session['retarget'] = True
+                moved += 1
+        return moved
+
+    def hibernate(self, user_id):
+        """Close an idle session's shell but keep its state, False if a command is running.
+
+        The next command reopens the shell and replays cwd and env.
+        """
+        lock = self.command_locks.get(user_id)
+        if lock is None or not lock.acquire(blocking=False):
+            return False
+        try:
+            session = self.sessions.get(user_id)
+            shell = session.pop('shell', None) if session is not None else None
+        finally:
+            lock.release()
+
+        if shell is not None:
+            self.pool.release(shell)
+            print(f"💤 Hibernated idle session for user {user_id}")
+        return True
+
+    def _shell_alive(self, shell):
+        if shell is None or shell.closed:
+            return False
+        transport = shell.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _reconnect(self, user_id):
+        """Reconnect with bounded exponential backoff, first retry is immediate"""
+        for attempt in range(self.reconnect_attempts):
+            if attempt:
+                delay = min(self.reconnect_base_delay * 2 ** (attempt - 1), self.reconnect_max_delay)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+            if not self.session_active.get(user_id):
+                return False
+            if self.connect_ssh(user_id):
+                self.sessions[user_id]['reconnects'] += 1
+                self.metrics.inc('reconnects_total')
+                print(f"🔄 Reconnected session for user {user_id} (attempt {attempt + 1})")
+                return True
+        return False
+
+    def _track_env(self, session, command):
+        """Remember variables set with export/unset so they survive reconnects"""
+        try:
+            lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+            lexer.whitespace_split = True
+            tokens = list(lexer)
+        except ValueError:
+            return
+
+        exported = []
+        action = None
+        for token in tokens:
+            if token in ('export', 'unset'):
+                action = token
+            elif action and not set(token) <= set('&|;()'):
+                name = token.split('=', 1)[0]
+                if not ENV_NAME_PATTERN.match(name):
+                    continue
+                if action == 'unset':
+                    session['env'].pop(name, None)
+                    exported = [other for other in exported if other != name]
+                else:
+                    exported.append(name)
+            else:
+                action = None
+
+        if exported:
+            # Read back the expanded values instead of guessing the shell's quoting
+            query = 'printf "%s\\0" ' + ' '.join(f'"${{{name}-}}"' for name in exported)
+            output, exit_code, _ = self._run_until_marker(session['shell'], query, timeout=5)
+            values = output.split('\0')
+            if exit_code == 0 and len(values) >= len(exported):
+                session['env'].update(zip(exported, values))
+
+    def _run_until_marker(self, shell, command, timeout, on_output=None, session=None):
+        """Send a command and read until its end marker, returns (output, exit_code, cwd).
+
+        Output is None when cancel() dropped the session's running command
+        before it was sent.
+        """
+        token = uuid.uuid4().hex[:12]
+        # Braces make the shell read the whole command before running it, so a
+        # command reading stdin cannot swallow the marker line
+        line = f"{{ {command}\n}}; printf '\\n{MARKER_PREFIX}%s_%d:%s__\\n' {token} $? \"$PWD\"\n"
+        if session is None:
+            shell.send(line)
+        else:
+            # Under cancel_lock, a cancel() either comes first and the command is
+            # never sent, or sees the token and interrupts it
+            with self.cancel_lock:
+                running = session.get('running')
+                if running is not None:
+                    if running['cancelled']:
+                        return None, None, None
+                    running['sent'] = True
+                shell.send(line)
+                session['token'] = token
+
+        screen = session.get('screen') if session is not None else None
+        if screen is not None:
+            screen.begin_command()
+        reader = OutputReader(token, raw_sink=screen.feed if screen is not None else None)
+        sent = time.perf_counter()
+        deadline = time.time() + timeout
+        shell.settimeout(0.2)
+
+        received = 0
+        # Exit code of the marker sent after Ctrl-C: 124 on timeout like timeout(1), 130 on cancel()
+        interrupted = None
+        marker_due = None
+        try:
+            while not reader.finished:
+                if marker_due is not None and time.time() >= marker_due:
+                    # Repeated in case the tty flush ate it, extra copies are
+                    # stale markers the next reader drops
+                    shell.send(f"printf '\\n{MARKER_PREFIX}%s_%d:%s__\\n' {token} {interrupted} \"$PWD\"\n")
+                    marker_due = time.time() + MARKER_RESEND
+                if interrupted is None and session is not None and session.get('interrupt'):
+                    interrupted = 130
+                    deadline = time.time() + INTERRUPT_GRACE
+                    shell.send('\x03')
+                    marker_due = time.time() + INTERRUPT_SETTLE
+                if time.time() > deadline:
+                    if interrupted is None:
+                        # Stop the command so the next one is not typed into it
+                        interrupted = 124
+                        deadline = time.time() + INTERRUPT_GRACE
+                        shell.send('\x03')
+                        marker_due = time.time() + INTERRUPT_SETTLE
+                        continue
+                    # Still not back at a prompt (ignores SIGINT, open quote, ...):
+                    # drop the shell, the next command reconnects
+                    shell.close()
+                    text = reader.flush()
+                    if on_output and text:
+                        on_output(text)
+                    waited = f" after {timeout}s" if interrupted == 124 else ''
+                    note = f"... (no response to Ctrl-C{waited}, the shell will be reopened)"
+                    return f"{reader.text()}\n{note}".lstrip('\n'), None, None
+                try:
+                    chunk = shell.recv(32768)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    raise EOFError("SSH channel closed")
+                if not received and session is not None:
+                    # Round trip until the remote side answers a user command
+                    self.metrics.observe('stage_seconds', time.perf_counter() - sent, stage='first_output')
+                received += len(chunk)
+                text = reader.feed(chunk)
+                if on_output and text:
+                    on_output(text)
+        finally:
+            self.metrics.inc('ssh_bytes_read_total', received)
+            if session is not None:
+                with self.cancel_lock:
+                    session.pop('token', None)
+                    session.pop('interrupt', None)
+
+        if interrupted == 124:
+            return f"{reader.text()}\n... (interrupted after {timeout}s)".lstrip('\n'), reader.exit_code, reader.cwd
+        return reader.text(), reader.exit_code, reader.cwd
+
+    async def start_session(self, user_id):
+        """Create a session without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.create_session, user_id)
+
+    async def run_command(self, user_id, command, on_output=None):
+        """Queue a command on the user's session and run it without blocking the event loop"""
+        session = self.sessions.get(user_id)
+        if session is None or not self.session_active.get(user_id):
+            return {'output': "Session not active. Use /start to begin a new session.", 'exit_code': None}
+
+        # Backpressure: reject instead of piling up work behind a slow command
+        if len(session['pending']) >= self.max_queue_depth:
+            return {
+                'output': f"⛔ Queue full ({self.max_queue_depth} pending). Use /queue or /cancel.",
+                'exit_code': None
+            }
+
+        entry = {'id': uuid.uuid4().hex[:8], 'command': command, 'queued_at': time.time(), 'cancelled': False}
+        session['pending'].append(entry)
+        try:
+            # asyncio.Lock wakes waiters in FIFO order
+            async with self.queue_locks[user_id]:
+                if entry in session['pending']:
+                    session['pending'].remove(entry)
+                if entry['cancelled'] or not self.session_active.get(user_id):
+                    return {'output': "Command cancelled before it started", 'exit_code': None}
+
+                entry['started_at'] = time.time()
+                session['running'] = entry
+                self.metrics.observe('stage_seconds', entry['started_at'] - entry['queued_at'], stage='queue_wait')
+                try:
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(
+                        self.executor, self.execute_command, user_id, command, on_output
+                    )
+                    if not entry['cancelled']:
+                        self._audit(user_id, entry, result)
+                    return result
+                finally:
+                    session['running'] = None
+        finally:
+            if entry in session['pending']:
+                session['pending'].remove(entry)
+
+    def _audit(self, user_id, entry, result):
+        """Queue the audit record of a finished command, the digest is computed by the writer"""
+        if self.audit is None:
+            return
+        session = self.sessions.get(user_id)
+        self.audit.record(
+            tenant=self.journal_key,
+            user=user_id,
+            action='shell',
+            session=self._session_id(session) if session else None,
+            id=entry['id'],
+            command=entry['command'],
+            exit_code=result['exit_code'],
+            duration=round(time.time() - entry['started_at'], 3),
+            output=result['output']
+        )
+
+    def get_queue(self, user_id):
+        """Running and pending commands of a session"""
+        session = self.sessions.get(user_id)
+        if session is None:
+            return {'running': None, 'pending': []}
+        return {'running': session['running'], 'pending': list(session['pending'])}
+
+    def cancel(self, user_id):
+        """Drop pending commands and send Ctrl-C to the running one.
+
+        A running command that was not sent to the shell yet is dropped
+        instead and returned as 'skipped'.
+        """
+        session = self.sessions.get(user_id)
+        if session is None:
+            return None
+
+        dropped = len(session['pending'])
+        for entry in session['pending']:
+            entry['cancelled'] = True
+        session['pending'].clear()
+
+        running = session['running']
+        with self.cancel_lock:
+            # The token exists while the sent command is being read
+            token = session.get('token')
+            skipped = running is not None and not running.get('sent')
+            if skipped:
+                running['cancelled'] = True
+            elif token is not None:
+                # The reading thread sends Ctrl-C and then, once the tty has
+                # settled, the end marker the interrupted command never prints
+                session['interrupt'] = True
+
+        return {
+            'interrupted': running['command'] if running and token is not None else None,
+            'skipped': running['command'] if skipped else None,
+            'dropped': dropped
+        }
+
+    def stop_session(self, user_id):
+        """Stop a user's session"""
+        if user_id in self.session_active:
+            self.session_active[user_id] = False
+            self.cancel(user_id)
+
+            # Close the shell channel, the transport stays in the pool
+            shell = self.sessions.get(user_id, {}).pop('shell', None)
+            if shell is not None:
+                self.pool.release(shell)
+            if self.governor is not None:
+                self.governor.release_shell(self, user_id)
+
+            if self.journal is not None:
+                try:
+                    self.journal.delete(self.journal_key, user_id)
+                except Exception as e:
+                    print(f"⚠️ Session journal delete failed for user {user_id}: {e}")
+
+            # Clear session data
+            if user_id in self.sessions:
+                session_info = self.sessions[user_id]
+                duration = datetime.now() - session_info['start_time']
+                del self.sessions[user_id]
+
+                return {
+                    'duration': duration,
+                    'commands_count': session_info['commands_count']
+                }
+        return None
+
+    def get_screen(self, user_id):
+        """Terminal screen model of a user's session, or None"""
+        if not self.session_active.get(user_id, False):
+            return None
+        return self.sessions[user_id].get('screen')
+
+    def get_session_info(self, user_id):
+        """Get session information"""
+        if user_id in self.sessions and self.session_active.get(user_id, False):
+            session = self.sessions[user_id]
+            duration = datetime.now() - session['start_time']
+            last_active = int(time.time() - self.last_activity[user_id])
+
+            return {
+                'active': True,
+                'duration': duration,
+                'commands_count': session['commands_count'],
+                'last_activity': last_active,
+                'current_dir': session['current_dir'],
+                'reconnects': session['reconnects'],
+                'hibernated': 'shell' not in session
+            }
+        return {'active': False}
@@ -0,0 +1,266 @@
+import time
+import socket
+import hashlib
+import threading
+import paramiko
+
+
+class SSHConnectionPool:
+    """Shared SSH transports keyed by (host, port, username, credential fingerprint).
+
+    Sessions get their own shell channel, but channels to the same target are
+    multiplexed over a few long-lived transports, so starting a session is a
+    channel open instead of a full TCP + key exchange handshake. sshd limits
+    channels per connection (MaxSessions, 10 by default), so a key can own
+    several transports, each carrying up to `max_channels` channels. The
+    password is part of the key (as a SHA-256 fingerprint), so a caller with
+    other credentials never gets a channel on a transport someone else
+    authenticated.
+    """
+
+    def __init__(self, max_transports=8, max_channels=8, idle_timeout=300, connect_timeout=15,
+                 keepalive=30):
+        self.max_transports = max_transports
+        self.max_channels = max_channels
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive = keepalive
+
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.connect_locks = {}
+        self.owners = {}
+        self.pending = 0
+        # Transports of changed credentials, closed once their last channel is released
+        self.retired = []
+
+    def open_shell(self, host, port, username, password='', width=80, height=24):
+        """Open an interactive shell channel on a pooled transport"""
+        return self._open_channel(host, port, username, password,
+                                  lambda client: client.invoke_shell(width=width, height=height))
+
+    def open_session(self, host, port, username, password=''):
+        """Open a bare session channel (for exec_command) on a pooled transport"""
+        return self._open_channel(host, port, username, password,
+                                  lambda client: client.get_transport().open_session())
+
+    def open_sftp(self, host, port, username, password=''):
+        """Open an SFTP client on a pooled transport, release it with release(sftp.get_channel())"""
+        def opener(client):
+            channel = client.get_transport().open_session()
+            channel.invoke_subsystem('sftp')
+            return channel
+
+        channel = self._open_channel(host, port, username, password, opener)
+        try:
+            return paramiko.SFTPClient(channel)
+        except Exception:
+            self.release(channel, broken=True)
+            raise
+
+    @staticmethod
+    def _key(host, port, username, password):
+        return host, port, username, hashlib.sha256((password or '').encode('utf-8')).hexdigest()
+
+    def _open_channel(self, host, port, username, password, opener):
+        key = self._key(host, port, username, password)
+        with self.lock:
+            connect_lock = self.connect_locks.setdefault(key, threading.Lock())
+
+        # Callers for the same target wait here and then share the new transport
+        with connect_lock:
+            connection = self._acquire(key)
+            if connection is None:
+                connection = self._connect(key, password)
+
+            try:
+                channel = opener(connection['client'])
+            except Exception:
+                with self.lock:
+                    connection['reserved'] -= 1
+                raise
+
+            with self.lock:
+                connection['reserved'] -= 1
+                connection['channels'].add(channel)
+                connection['last_used'] = time.time()
+                self.owners[id(channel)] = connection
+            return channel
+
+    def _acquire(self, key):
+        """Reserve a slot on a healthy transport with spare channels, or None"""
+        with self.lock:
+            connections = self.connections.get(key, [])
+            for connection in list(connections):
+                if not self._is_healthy(connection):
+                    self._discard(key, connection)
+                    continue
+                self._prune(connection)
+                if len(connection['channels']) + connection['reserved'] < self.max_channels:
+                    connection['reserved'] += 1
+                    return connection
+        return None
+
+    def _connect(self, key, password):
+        host, port, username, _ = key
+        with self.lock:
+            if self._transport_count() >= self.max_transports and not self._evict_lru():
+                raise RuntimeError(f"SSH pool exhausted ({self.max_transports} transports in use)")
+            self.pending += 1
+
+        try:
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            if password:
+                client.connect(host, port, username, password, timeout=self.connect_timeout)
+            else:
+                client.connect(host, port, username, timeout=self.connect_timeout)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+        # Keepalives make dead links show up as an inactive transport
+        transport = client.get_transport()
+        if self.keepalive:
+            transport.set_keepalive(self.keepalive)
+            try:
+                transport.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            except (AttributeError, OSError):
+                pass
+
+        connection = {
+            'client': client,
+            'password': password,
+            'channels': set(),
+            'reserved': 1,
+            'created': time.time(),
+            'last_used': time.time()
+        }
+        with self.lock:
+            self.connections.setdefault(key, []).append(connection)
+        print(f"🔌 SSH transport opened: {username}@{host}:{port}")
+        return connection
+
+    def retire(self, host, port, username, password=''):
+        """Stop handing out channels on the transports of these credentials, returns how many.
+
+        Idle transports close now, busy ones as soon as their last channel is
+        released, so a rotated or revoked password stops working without
+        cutting off commands that are still running.
+        """
+        key = self._key(host, port, username, password)
+        with self.lock:
+            connections = self.connections.pop(key, [])
+            for connection in connections:
+                self._prune(connection)
+                if connection['channels'] or connection['reserved']:
+                    self.retired.append(connection)
+                else:
+                    self._close(connection)
+        return len(connections)
+
+    def release(self, channel, broken=False):
+        """Close a channel and return its slot; broken=True also drops the transport"""
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+        with self.lock:
+            connection = self.owners.pop(id(channel), None)
+            if connection is None:
+                return
+            connection['channels'].discard(channel)
+            connection['last_used'] = time.time()
+            if connection in self.retired:
+                if not connection['channels'] and not connection['reserved']:
+                    self.retired.remove(connection)
+                    self._close(connection)
+            elif broken and not self._is_healthy(connection):
+                for key, connections in self.connections.items():
+                    if connection in connections:
+                        self._discard(key, connection)
+                        break
+
+    def evict_idle(self):
+        """Close transports that are dead or have carried no channels for idle_timeout"""
+        now = time.time()
+        evicted = 0
+        with self.lock:
+            for key, connections in list(self.connections.items()):
+                for connection in list(connections):
+                    self._prune(connection)
+                    idle = not connection['channels'] and not connection['reserved']
+                    if not self._is_healthy(connection) or (
+                            idle and now - connection['last_used'] > self.idle_timeout):
+                        self._discard(key, connection)
+                        evicted += 1
+            for connection in list(self.retired):
+                self._prune(connection)
+                if not connection['channels'] and not connection['reserved']:
+                    self.retired.remove(connection)
+                    self._close(connection)
+                    evicted += 1
+        return evicted
+
+    def stats(self):
+        """Transport and channel counts for status displays"""
+        with self.lock:
+            connections = [c for group in self.connections.values() for c in group]
+            return {
+                'targets': len(self.connections),
+                'transports': len(connections),
+                'channels': sum(len(c['channels']) for c in connections)
+            }
+
+    def close_all(self):
+        with self.lock:
+            for key, connections in list(self.connections.items()):
+                for connection in list(connections):
+                    self._discard(key, connection)
+            for connection in self.retired:
+                self._close(connection)
+            self.retired = []
+
+    # The helpers below expect self.lock to be held
+
+    def _is_healthy(self, connection):
+        transport = connection['client'].get_transport()
+        return transport is not None and transport.is_active()
+
+    def _prune(self, connection):
+        for channel in [c for c in connection['channels'] if c.closed]:
+            connection['channels'].discard(channel)
+            self.owners.pop(id(channel), None)
+
+    def _transport_count(self):
+        return self.pending + len(self.retired) + sum(len(connections) for connections in self.connections.values())
+
+    def _evict_lru(self):
+        idle = [
+            (connection['last_used'], key, connection)
+            for key, connections in self.connections.items()
+            for connection in connections
+            if not connection['channels'] and not connection['reserved']
+        ]
+        if not idle:
+            return False
+        _, key, connection = min(idle, key=lambda item: item[0])
+        self._discard(key, connection)
+        return True
+
+    def _discard(self, key, connection):
+        connections = self.connections.get(key, [])
+        if connection in connections:
+            connections.remove(connection)
+        if not connections:
+            self.connections.pop(key, None)
+        self._close(connection)
+
+    def _close(self, connection):
+        for channel in connection['channels']:
+            self.owners.pop(id(channel), None)
+        try:
+            connection['client'].close()
+        except Exception:
+            pass
@@ -1,22 +1,46 @@
 #!/usr/bin/env python3
 import os
+import re
+import hmac
+import ssl
+import signal
 import asyncio
+import hashlib
+import functools
+import secrets
 import subprocess
 import threading
 import time
 from datetime import datetime
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-import paramiko
+import httpx
 from io import StringIO
-from config_loader import load_web_config_as_env
+from config_loader import WebConfigLoader, load_web_config_as_env, set_env_vars
+from ssh_pool import SSHConnectionPool
+from fanout import FanoutRunner, fold_results
+from file_transfer import FileTransfer, StreamedInputFile, resolve_remote_path
+from tenants import Tenant
+from session_journal import SessionJournal
+from resource_governor import ResourceGovernor
+from webhook_server import WebhookServer
+from metrics import Metrics
+from audit_log import AuditLog
+from command_history import CommandHistory
+from output_store import OutputStore
+from message_stream import MessageStream
+from outbound import OutboundScheduler, PRIORITY_BACKGROUND
 
 print("🤖 Starting Telegram Terminal Bot...")
 print("🌐 Loading configuration from web interface...")
 
 # 웹페이지에서 설정 로드 (필수)
 WEB_CONFIG_URL = 'https://bzjay53.github.io/devbot'
+CONFIG_SNAPSHOT_PATH = os.getenv('CONFIG_SNAPSHOT_PATH', 'data/config_snapshot.json')
+CONFIG_POLL_INTERVAL = int(os.getenv('CONFIG_POLL_INTERVAL', 60))
+web_config = None
 
 # 사용자에게 웹 설정 안내
 def wait_for_web_config():
@@ -38,15 +62,21 @@ def wait_for_web_config():
         print("Or run with: WEB_PASSWORD='your_password' python telegram_terminal_bot_persistent.py")
         return False
     
+    global web_config
+    web_config = WebConfigLoader(WEB_CONFIG_URL, password, snapshot_path=CONFIG_SNAPSHOT_PATH)
+    
+    # 마지막 정상 설정으로 바로 부팅하고, 웹 확인은 시작 후 백그라운드에서
+    snapshot = web_config.load_snapshot()
+    if snapshot:
+        set_env_vars(web_config.get_env_vars(snapshot))
+        return True
+    
     try:
         print(f"🔍 Checking configuration with environment password...")
         
-        from config_loader import WebConfigLoader
-        loader = WebConfigLoader(WEB_CONFIG_URL, password)
-        
-        if loader.validate_config():
+        if web_config.validate_config():
             print(f"✅ Found valid configuration!")
-            return load_web_config_as_env(WEB_CONFIG_URL, password)
+            return load_web_config_as_env(WEB_CONFIG_URL, password, loader=web_config)
         else:
             print("❌ No valid bot configuration found!")
             print("Please check:")
@@ -66,156 +96,218 @@ if not wait_for_web_config():
     exit(1)
 
 # Configuration
-BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
-SSH_HOST = os.getenv('SSH_HOST', 'localhost')
-SSH_PORT = int(os.getenv('SSH_PORT', 22))
-SSH_USERNAME = os.getenv('SSH_USERNAME', 'root')
-SSH_PASSWORD = os.getenv('SSH_PASSWORD', '')
-ALLOWED_USERS = os.getenv('ALLOWED_USERS', '').split(',')
-MAX_OUTPUT_LENGTH = int(os.getenv('MAX_OUTPUT_LENGTH', 4000))
-CLAUDE_CODE_PATH = os.getenv('CLAUDE_CODE_PATH', '/usr/local/bin/claude')
-WORKING_DIR = os.getenv('WORKING_DIR', '/root/christmas-trading')
-
-# Session Management
-class SessionManager:
-    def __init__(self):
-        self.sessions = {}
-        self.ssh_clients = {}
-        self.last_activity = {}
-        self.session_active = {}
-        self.monitoring_thread = None
-        
-    def create_session(self, user_id):
-        """Create a new persistent session"""
-        if user_id not in self.sessions:
-            self.sessions[user_id] = {
-                'start_time': datetime.now(),
-                'commands_count': 0,
-                'current_dir': WORKING_DIR
-            }
-            self.session_active[user_id] = True
-            self.last_activity[user_id] = time.time()
-            
-            # Create SSH connection for this user
-            if self.connect_ssh(user_id):
-                return True
-        return False
-    
-    def connect_ssh(self, user_id):
-        """Establish SSH connection for a user"""
-        try:
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            if SSH_PASSWORD:
-                client.connect(SSH_HOST, SSH_PORT, SSH_USERNAME, SSH_PASSWORD)
-            else:
-                client.connect(SSH_HOST, SSH_PORT, SSH_USERNAME)
-            
-            self.ssh_clients[user_id] = client
-            
-            # Open persistent shell channel
-            shell = client.invoke_shell()
-            self.sessions[user_id]['shell'] = shell
-            
-            # Set working directory
-            shell.send(f'cd {WORKING_DIR}\n')
-            time.sleep(0.5)
-            
-            return True
-        except Exception as e:
-            print(f"SSH connection error for user {user_id}: {e}")
-            return False
-    
-    def execute_command(self, user_id, command):
-        """Execute command in user's session"""
-        if user_id not in self.session_active or not self.session_active[user_id]:
-            return "Session not active. Use /start to begin a new session."
-        
-        self.last_activity[user_id] = time.time()
-        self.sessions[user_id]['commands_count'] += 1
-        
-        try:
-            shell = self.sessions[user_id]['shell']
-            
-            # Send command
-            shell.send(command + '\n')
-            
-            # Wait for output
-            time.sleep(0.5)
-            output = ''
-            
-            while shell.recv_ready():
-                chunk = shell.recv(4096).decode('utf-8')
-                output += chunk
-                if len(output) > MAX_OUTPUT_LENGTH:
-                    output = output[:MAX_OUTPUT_LENGTH] + "\n... (output truncated)"
-                    break
-            
-            return output if output else "Command executed (no output)"
-            
-        except Exception as e:
-            # Try to reconnect
-            if self.connect_ssh(user_id):
-                return self.execute_command(user_id, command)
-            return f"Session error: {e}"
-    
-    def stop_session(self, user_id):
-        """Stop a user's session"""
-        if user_id in self.session_active:
-            self.session_active[user_id] = False
-            
-            # Close SSH connection
-            if user_id in self.ssh_clients:
-                self.ssh_clients[user_id].close()
-                del self.ssh_clients[user_id]
-            
-            # Clear session data
-            if user_id in self.sessions:
-                session_info = self.sessions[user_id]
-                duration = datetime.now() - session_info['start_time']
-                del self.sessions[user_id]
-                
-                return {
-                    'duration': duration,
-                    'commands_count': session_info['commands_count']
-                }
+# Per-bot settings (token, SSH target, users, paths) live on each Tenant
+MULTI_BOT = os.getenv('MULTI_BOT', 'false').lower() in ('1', 'true', 'yes')
+TENANT_MAX_SESSIONS = int(os.getenv('TENANT_MAX_SESSIONS', 0))
+COMMAND_TIMEOUT = int(os.getenv('COMMAND_TIMEOUT', 300))
+STREAM_INTERVAL = float(os.getenv('STREAM_INTERVAL', 1.5))
+COMMAND_WORKERS = int(os.getenv('COMMAND_WORKERS', 16))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+SSH_POOL_MAX_TRANSPORTS = int(os.getenv('SSH_POOL_MAX_TRANSPORTS', 8))
+SSH_POOL_MAX_CHANNELS = int(os.getenv('SSH_POOL_MAX_CHANNELS', 8))
+SSH_POOL_IDLE_TIMEOUT = int(os.getenv('SSH_POOL_IDLE_TIMEOUT', 300))
+SSH_KEEPALIVE = int(os.getenv('SSH_KEEPALIVE', 30))
+SSH_RECONNECT_ATTEMPTS = int(os.getenv('SSH_RECONNECT_ATTEMPTS', 5))
+MAX_QUEUE_DEPTH = int(os.getenv('MAX_QUEUE_DEPTH', 5))
+JOB_LOG_DIR = os.getenv('JOB_LOG_DIR', 'logs/jobs')
+JOB_LOG_MAX_BYTES = int(os.getenv('JOB_LOG_MAX_BYTES', 1024 * 1024))
+MAX_BG_JOBS = int(os.getenv('MAX_BG_JOBS', 5))
+OUTPUT_STORE_MAX_MB = int(os.getenv('OUTPUT_STORE_MAX_MB', 16))
+OUTPUT_STORE_MAX_DISK_MB = int(os.getenv('OUTPUT_STORE_MAX_DISK_MB', 256))
+OUTPUT_STORE_MAX_AGE = int(os.getenv('OUTPUT_STORE_MAX_AGE', 3600))
+OUTPUT_STORE_DIR = os.getenv('OUTPUT_STORE_DIR', 'logs/outputs')
+SCREEN_COLS = int(os.getenv('SCREEN_COLS', 80))
+SCREEN_ROWS = int(os.getenv('SCREEN_ROWS', 24))
+SESSION_JOURNAL_PATH = os.getenv('SESSION_JOURNAL_PATH', 'data/sessions.db')
+AUDIT_LOG_DIR = os.getenv('AUDIT_LOG_DIR', 'logs/audit')
+AUDIT_LOG_MAX_MB = int(os.getenv('AUDIT_LOG_MAX_MB', 16))
+AUDIT_LOG_ROTATE_HOURS = float(os.getenv('AUDIT_LOG_ROTATE_HOURS', 24))
+HISTORY_PATH = os.getenv('HISTORY_PATH', 'data/history.db')
+HISTORY_MAX_ENTRIES = int(os.getenv('HISTORY_MAX_ENTRIES', 1000))
+HISTORY_MAX_OUTPUT_KB = int(os.getenv('HISTORY_MAX_OUTPUT_KB', 64))
+SESSION_IDLE_TIMEOUT = int(os.getenv('SESSION_IDLE_TIMEOUT', 1800))
+MAX_OPEN_SHELLS = int(os.getenv('MAX_OPEN_SHELLS', 200))
+MAX_USER_CHANNELS = int(os.getenv('MAX_USER_CHANNELS', 4))
+# Outbound Bot API limits per bot: messages/s overall and per chat, messages/min per group
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20))
+FANOUT_CONCURRENCY = int(os.getenv('FANOUT_CONCURRENCY', 16))
+FANOUT_TIMEOUT = int(os.getenv('FANOUT_TIMEOUT', 30))
+FANOUT_MAX_TRANSPORTS = int(os.getenv('FANOUT_MAX_TRANSPORTS', 64))
+# Bot API limits: bots upload up to 50 MB and download up to 20 MB
+FILE_MAX_MB = int(os.getenv('FILE_MAX_MB', 50))
+FILE_DOWNLOAD_MAX_MB = int(os.getenv('FILE_DOWNLOAD_MAX_MB', 20))
+FILE_TRANSFER_TIMEOUT = int(os.getenv('FILE_TRANSFER_TIMEOUT', 600))
+FILE_SPOOL_DIR = os.getenv('FILE_SPOOL_DIR', 'data/transfers')
+# Prometheus-style /metrics for a local scraper, only served when a port is set (e.g. 9464)
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 0)
+# Users allowed to see /stats (process-wide numbers), a tenant's own users when empty
+ADMIN_USERS = [user for user in os.getenv('ADMIN_USERS', '').split(',') if user]
+# Public HTTPS base URL for webhooks, long polling is used when empty
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+# Certificate (PEM, with the key unless WEBHOOK_KEY is set) to serve HTTPS directly,
+# without one the listener is plain HTTP behind a TLS-terminating proxy
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT', '')
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY', '')
+# The webhook is re-registered on every start, so a random secret works too
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_hex(32)
+
+# Stage timers and counters of the whole process, see /stats and /metrics
+metrics = Metrics()
+
+# Shared SSH transports, sessions open channels on these
+ssh_pool = SSHConnectionPool(
+    max_transports=SSH_POOL_MAX_TRANSPORTS,
+    max_channels=SSH_POOL_MAX_CHANNELS,
+    idle_timeout=SSH_POOL_IDLE_TIMEOUT,
+    keepalive=SSH_KEEPALIVE
+)
+
+# Fleet hosts for /fanout get their own transports, so a large group cannot exhaust the session pool
+fanout_pool = SSHConnectionPool(
+    max_transports=FANOUT_MAX_TRANSPORTS,
+    max_channels=SSH_POOL_MAX_CHANNELS,
+    idle_timeout=SSH_POOL_IDLE_TIMEOUT,
+    keepalive=SSH_KEEPALIVE
+)
+fanout = FanoutRunner(fanout_pool, max_parallel=FANOUT_CONCURRENCY, timeout=FANOUT_TIMEOUT)
+
+# /get and /put over SFTP on the session transports
+file_transfer = FileTransfer(ssh_pool, spool_dir=FILE_SPOOL_DIR, max_bytes=FILE_MAX_MB * 1024 * 1024)
+
+# Full command outputs for paging and download, shared by all tenants
+output_store = OutputStore(
+    page_size=3500,
+    max_memory_bytes=OUTPUT_STORE_MAX_MB * 1024 * 1024,
+    max_disk_bytes=OUTPUT_STORE_MAX_DISK_MB * 1024 * 1024,
+    max_age=OUTPUT_STORE_MAX_AGE,
+    spill_dir=OUTPUT_STORE_DIR
+)
+
+# Bot configurations served by this process, keyed by WebConfigLoader.config_key
+tenants = {}
+# Bots whose Application failed to start (bad token, Telegram down), retried on every config poll
+restart_pending = {}
+
+# Caps open shells across all tenants, idle sessions are hibernated
+governor = ResourceGovernor(
+    max_shells=MAX_OPEN_SHELLS,
+    max_user_channels=MAX_USER_CHANNELS,
+    idle_timeout=SESSION_IDLE_TIMEOUT
+)
+
+# Open sessions of all tenants, restored lazily after a restart
+session_journal = SessionJournal(SESSION_JOURNAL_PATH) if SESSION_JOURNAL_PATH else None
+
+# Who ran what on which session, written in the background and rotated into gzipped segments
+audit_log = AuditLog(
+    AUDIT_LOG_DIR,
+    max_bytes=AUDIT_LOG_MAX_MB * 1024 * 1024,
+    max_age=AUDIT_LOG_ROTATE_HOURS * 3600
+) if AUDIT_LOG_DIR else None
+
+# Commands and outputs of every user for /history, /grep and !n, kept across sessions and restarts
+command_history = CommandHistory(
+    HISTORY_PATH,
+    max_entries=HISTORY_MAX_ENTRIES,
+    max_output_chars=HISTORY_MAX_OUTPUT_KB * 1024
+) if HISTORY_PATH else None
+
+def webhook_ssl_context():
+    """TLS context for the webhook listener, None when a proxy terminates TLS"""
+    if not WEBHOOK_CERT:
         return None
-    
-    def get_session_info(self, user_id):
-        """Get session information"""
-        if user_id in self.sessions and self.session_active.get(user_id, False):
-            session = self.sessions[user_id]
-            duration = datetime.now() - session['start_time']
-            last_active = int(time.time() - self.last_activity[user_id])
-            
-            return {
-                'active': True,
-                'duration': duration,
-                'commands_count': session['commands_count'],
-                'last_activity': last_active,
-                'current_dir': session['current_dir']
-            }
-        return {'active': False}
-
-# Global session manager
-session_manager = SessionManager()
-
-def is_authorized(user_id):
-    """Check if user is authorized"""
-    return str(user_id) in ALLOWED_USERS or not ALLOWED_USERS[0]
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY or None)
+    return context
+
+# Embedded HTTP server for webhook mode, one route per tenant
+webhook_server = WebhookServer(
+    WEBHOOK_LISTEN, WEBHOOK_PORT, ssl_context=webhook_ssl_context()
+) if WEBHOOK_URL else None
+
+# Separate listener so metrics stay on the local interface when webhooks are public
+metrics_server = WebhookServer(METRICS_LISTEN, METRICS_PORT) if METRICS_PORT else None
+
+def build_tenant(key, name, env):
+    """Tenant with its own sessions and jobs on the shared SSH pool"""
+    return Tenant(
+        key, name, env, ssh_pool,
+        max_sessions=TENANT_MAX_SESSIONS,
+        job_log_dir=JOB_LOG_DIR,
+        job_log_max_bytes=JOB_LOG_MAX_BYTES,
+        max_bg_jobs=MAX_BG_JOBS,
+        governor=governor,
+        audit=audit_log,
+        history=command_history,
+        max_workers=COMMAND_WORKERS,
+        command_timeout=COMMAND_TIMEOUT,
+        reconnect_attempts=SSH_RECONNECT_ATTEMPTS,
+        max_queue_depth=MAX_QUEUE_DEPTH,
+        screen_cols=SCREEN_COLS,
+        screen_rows=SCREEN_ROWS,
+        journal=session_journal,
+        metrics=metrics
+    )
+
+def tenant_configs():
+    """{key: (name, env vars)} of the bot configs this process serves, from the loader cache"""
+    configs = web_config.all_configs() if MULTI_BOT else [web_config.config_cache]
+    return {
+        web_config.config_key(config): (config.get('projectName', ''), web_config.get_env_vars(config))
+        for config in configs
+        if config and not WebConfigLoader.missing_fields(config)
+    }
+
+# !n recalls command number n, !! the last one
+HISTORY_RECALL = re.compile(r'^!(\d+|!)$')
+
+def get_tenant(context):
+    """Tenant of the bot that received the update"""
+    return context.bot_data['tenant']
+
+def audit(tenant, user_id, action, **fields):
+    """Audit record of an action outside the interactive shell (fan-out, file transfer)"""
+    if audit_log is not None:
+        audit_log.record(tenant=tenant.key, user=user_id, action=action, **fields)
+
+def queue_placeholder(tenant, user_id):
+    """Placeholder text for a command that may have to wait its turn"""
+    queue = tenant.session_manager.get_queue(user_id)
+    if queue['running']:
+        return f"⏳ queued (position {len(queue['pending']) + 1})"
+    return '⏳ running...'
+
+def format_exit_status(result):
+    """Exit status line shown under command output"""
+    if result['exit_code'] is None:
+        return ""
+    if result['exit_code'] == 0:
+        return "\n✅ exit 0"
+    return f"\n❌ exit {result['exit_code']}"
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler - creates persistent session"""
     user_id = update.effective_user.id
+    tenant = get_tenant(context)
     
-    if not is_authorized(user_id):
+    if not tenant.is_authorized(user_id):
         await update.message.reply_text("Unauthorized access")
         return
     
+    # Per-tenant quota on concurrent sessions
+    if tenant.session_limit_reached() and not tenant.session_manager.get_session_info(user_id)['active']:
+        await update.message.reply_text(f"⛔ Session limit reached ({tenant.max_sessions}). Try again later.")
+        return
+    
     # Create session
-    if session_manager.create_session(user_id):
+    if await tenant.session_manager.start_session(user_id):
         keyboard = [
             [InlineKeyboardButton("📟 Session Info", callback_data='session_info')],
             [InlineKeyboardButton("🚀 Quick Commands", callback_data='quick_commands')],
@@ -243,14 +335,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             data=user_id,
             name=f"monitor_{user_id}"
         )
+        # Journal write, kept off the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            tenant.session_manager.executor, tenant.session_manager.set_monitor, user_id, 600
+        )
     else:
         await update.message.reply_text("Failed to create session. Please try again.")
 
 async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Stop command handler - ends session"""
     user_id = update.effective_user.id
+    tenant = get_tenant(context)
     
-    if not is_authorized(user_id):
+    if not tenant.is_authorized(user_id):
         await update.message.reply_text("Unauthorized access")
         return
     
@@ -259,8 +356,10 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for job in jobs:
         job.schedule_removal()
     
-    # Stop session
-    session_info = session_manager.stop_session(user_id)
+    # Stop session, closing the shell and deleting the journal entry block
+    session_info = await asyncio.get_running_loop().run_in_executor(
+        tenant.session_manager.executor, tenant.session_manager.stop_session, user_id
+    )
     
     if session_info:
         await update.message.reply_text(
@@ -276,13 +375,14 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text commands"""
     user_id = update.effective_user.id
+    tenant = get_tenant(context)
     
-    if not is_authorized(user_id):
+    if not tenant.is_authorized(user_id):
         await update.message.reply_text("Unauthorized access")
         return
     
     # Check if session is active
-    session_info = session_manager.get_session_info(user_id)
+    session_info = tenant.session_manager.get_session_info(user_id)
     if not session_info['active']:
         await update.message.reply_text(
             "No active session. Use /start to begin a new session."
@@ -291,26 +391,605 @@ async def handle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     command = update.message.text
     
-    # Send typing action
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    # !n and !! run a command from the history again without retyping it
+    recall = HISTORY_RECALL.match(command.strip())
+    if recall:
+        number = None if recall.group(1) == '!' else int(recall.group(1))
+        entry = await asyncio.to_thread(tenant.session_manager.get_history_entry, user_id, number, False)
+        if entry is None:
+            await update.message.reply_text(f"No command {recall.group(0)} in your history. See /history")
+            return
+        command = entry['command']
+    
+    # Stream output into a message that is edited in place while the command runs
+    with metrics.timer('stage_seconds', stage='reply'):
+        stream = MessageStream(update.message, f"$ {command}", interval=STREAM_INTERVAL,
+                               screen=tenant.session_manager.get_screen(user_id), metrics=metrics)
+        await stream.start(queue_placeholder(tenant, user_id))
+        
+        # Execute command
+        result = await tenant.session_manager.run_command(user_id, command, on_output=stream.feed)
+        await stream.finish(result, format_exit_status(result), await browse_keyboard(tenant, user_id, command, result))
+
+def pager_keyboard(output_id, page, pages):
+    """Prev/next/download buttons for a stored output"""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f'page:{output_id}:{page - 1}'))
+    buttons.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data='noop'))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f'page:{output_id}:{page + 1}'))
+    return InlineKeyboardMarkup([
+        buttons,
+        [InlineKeyboardButton("⬇️ Download as file", callback_data=f'dl:{output_id}')]
+    ])
+
+def render_page(output_id, page, user_id):
+    """Text and keyboard for one page of a user's stored output, None once evicted"""
+    stored = output_store.get_page(output_id, page)
+    if stored is None or stored[0]['user_id'] != user_id:
+        return None
+    info, text, pages = stored
+    page = max(0, min(page, pages - 1))
+    response = f"```bash\n$ {info['command'][:200]}\n{text.rstrip()}\n```" + format_exit_status(info)
+    if pages == 1:
+        return response, None
+    return response + f"\n📄 Page {page + 1}/{pages}", pager_keyboard(output_id, page, pages)
+
+async def send_markdown(method, text, **kwargs):
+    """Send or edit with Markdown, falling back to plain text when the output breaks it"""
+    try:
+        return await method(text, parse_mode='Markdown', **kwargs)
+    except BadRequest as e:
+        if 'not modified' in str(e).lower():
+            return None
+        return await method(text, **kwargs)
+
+async def reply_paged(tenant, message, user_id, command, result):
+    """Store the full output and reply with its first page"""
+    output_id = await asyncio.to_thread(
+        output_store.put, user_id, command, result['output'], result['exit_code'], tenant.page_size
+    )
+    rendered = await asyncio.to_thread(render_page, output_id, 0, user_id)
+    if rendered is None:
+        # Evicted right away by a burst of larger outputs
+        await message.reply_text("⌛ This output has expired. Run the command again.")
+        return
+    response, reply_markup = rendered
+    await send_markdown(message.reply_text, response, reply_markup=reply_markup)
+
+async def browse_keyboard(tenant, user_id, command, result):
+    """Browse/download buttons for a streamed reply whose output spans several pages"""
+    output_id = await asyncio.to_thread(
+        output_store.put, user_id, command, result['output'], result['exit_code'], tenant.page_size
+    )
+    pages = output_store.page_count(output_id)
+    if pages <= 1:
+        return None
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(f"📄 Browse {pages} pages", callback_data=f'page:{output_id}:0'),
+        InlineKeyboardButton("⬇️ Download", callback_data=f'dl:{output_id}')
+    ]])
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Interrupt the running command (Ctrl-C) and drop queued ones"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    cancelled = tenant.session_manager.cancel(user_id)
+    if cancelled is None:
+        await update.message.reply_text("No active session found.")
+        return
+    
+    if cancelled['interrupted']:
+        text = f"🛑 Sent Ctrl-C to: `{cancelled['interrupted']}`"
+    elif cancelled['skipped']:
+        text = f"🛑 Cancelled before it started: `{cancelled['skipped']}`"
+    else:
+        text = "Nothing is running."
+    if cancelled['dropped']:
+        text += f"\n🗑️ Dropped {cancelled['dropped']} queued command(s)"
+    await send_markdown(update.message.reply_text, text)
+
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the running and pending commands of the session"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
     
-    # Execute command
-    result = session_manager.execute_command(user_id, command)
+    queue = tenant.session_manager.get_queue(user_id)
+    if not queue['running'] and not queue['pending']:
+        await update.message.reply_text("📭 Queue is empty.")
+        return
     
-    # Format and send result
-    response = f"```bash\n$ {command}\n{result}\n```"
+    lines = ["📋 *Command Queue*\n"]
+    if queue['running']:
+        elapsed = int(time.time() - queue['running']['started_at'])
+        lines.append(f"▶️ `{queue['running']['command']}` ({elapsed}s)")
+    for position, entry in enumerate(queue['pending'], 1):
+        lines.append(f"{position}. `{entry['command']}`")
+    await send_markdown(update.message.reply_text, "\n".join(lines))
+
+def format_runtime(seconds):
+    """Human readable runtime like 1h02m03s"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+async def notify_job_finished(tenant, bot, chat_id, job):
+    """Push a notification with the last lines of a finished background job"""
+    icon = "✅" if job['status'] == 'done' else "❌"
+    tail = tenant.job_manager.tail(job['user_id'], job['id'], lines=15) or ''
+    await send_markdown(
+        functools.partial(bot.send_message, chat_id),
+        f"{icon} *Job #{job['id']} finished* (exit {job['exit_code']}, "
+        f"{format_runtime(tenant.job_manager.runtime(job))})\n"
+        f"`{job['command']}`\n"
+        f"```\n{tail[-3000:] or '(no output)'}\n```",
+        # Several jobs finishing together arrive as one message
+        rate_limit_args={'priority': PRIORITY_BACKGROUND, 'merge': True}
+    )
+
+def log_notify_error(future):
+    """Done callback of a notification scheduled from a worker thread, nobody awaits it"""
+    if not future.cancelled() and future.exception() is not None:
+        print(f"⚠️ Job notification failed: {future.exception()}")
+
+async def bg_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start a background job on its own SSH channel"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    if not context.args:
+        await update.message.reply_text("Usage: /bg <command>")
+        return
+    
+    command = update.message.text.split(None, 1)[1]
+    
+    # Jobs start where the interactive session currently is
+    session = tenant.session_manager.sessions.get(user_id, {})
+    cwd = session.get('current_dir', tenant.working_dir)
+    env = session.get('env', {})
+    
+    loop = asyncio.get_running_loop()
+    bot = context.bot
+    chat_id = update.effective_chat.id
+    
+    def on_finish(job):
+        # Called from the job reader thread
+        future = asyncio.run_coroutine_threadsafe(notify_job_finished(tenant, bot, chat_id, job), loop)
+        future.add_done_callback(log_notify_error)
+    
+    try:
+        job = await loop.run_in_executor(
+            tenant.session_manager.executor,
+            lambda: tenant.job_manager.start(user_id, command, cwd=cwd, env=env, on_finish=on_finish)
+        )
+    except Exception as e:
+        await update.message.reply_text(f"❌ Failed to start job: {e}")
+        return
+    
+    await send_markdown(
+        update.message.reply_text,
+        f"🚀 *Job #{job['id']} started*\n"
+        f"`{command}`\n\n"
+        f"Use /tail {job['id']} to follow it, /jobs to list jobs."
+    )
+
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List the user's background jobs"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
     
-    # Split long messages
-    if len(response) > 4096:
-        for i in range(0, len(response), 4096):
-            await update.message.reply_text(response[i:i+4096], parse_mode='Markdown')
+    jobs = tenant.job_manager.list_jobs(user_id)
+    if not jobs:
+        await update.message.reply_text("No background jobs. Start one with /bg <command>")
+        return
+    
+    icons = {'running': '⏳', 'done': '✅', 'failed': '❌'}
+    lines = ["🧰 *Background Jobs*\n"]
+    for job in jobs[-20:]:
+        exit_info = f", exit {job['exit_code']}" if job['exit_code'] is not None else ""
+        lines.append(
+            f"{icons.get(job['status'], '•')} #{job['id']} `{job['command'][:40]}` "
+            f"({format_runtime(tenant.job_manager.runtime(job))}{exit_info})"
+        )
+    await send_markdown(update.message.reply_text, "\n".join(lines))
+
+async def tail_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the last lines of a background job's log"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /tail <job id> [lines]")
+        return
+    
+    job_id = int(context.args[0])
+    lines = int(context.args[1]) if len(context.args) > 1 and context.args[1].isdigit() else 40
+    
+    job = tenant.job_manager.get_job(user_id, job_id)
+    output = tenant.job_manager.tail(user_id, job_id, lines=min(lines, 200))
+    if job is None:
+        await update.message.reply_text(f"Job #{job_id} not found.")
+        return
+    
+    await send_markdown(
+        update.message.reply_text,
+        f"📜 *Job #{job_id}* ({job['status']}, {format_runtime(tenant.job_manager.runtime(job))}, "
+        f"{job['bytes']} bytes)\n"
+        f"```\n{output[-3500:] or '(no output yet)'}\n```"
+    )
+
+async def screen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the session's terminal screen, only the changed lines after the first time"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    screen = tenant.session_manager.get_screen(user_id)
+    if screen is None:
+        await update.message.reply_text("No active session. Use /start to begin a new session.")
+        return
+    
+    previous = context.user_data.get('screen_snapshot')
+    full = previous is None or (context.args and context.args[0] == 'full')
+    current, changed = screen.diff(previous or [])
+    context.user_data['screen_snapshot'] = current
+    
+    if full:
+        body = '\n'.join(current) or '(empty screen)'
+        title = f"🖥️ *Screen* ({screen.cols}x{screen.rows})"
+    elif not changed:
+        await update.message.reply_text("🖥️ Screen unchanged. Use /screen full to see all of it.")
+        return
     else:
-        await update.message.reply_text(response, parse_mode='Markdown')
+        body = '\n'.join(f"{row + 1:>2}│{text}" for row, text in changed)
+        title = f"🖥️ *Screen* ({len(changed)} changed lines)"
+    
+    await send_markdown(update.message.reply_text, f"{title}\n```\n{body}\n```")
+
+def format_history_line(entry):
+    """One /history line: number, command and exit status"""
+    status = '⏳' if entry['exit_code'] is None else ('✅' if entry['exit_code'] == 0 else f"❌ {entry['exit_code']}")
+    return f"`!{entry['number']}` `{entry['command'][:60]}` {status}"
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List past commands, or show the saved output of one without running it again"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    if command_history is None:
+        await update.message.reply_text("Command history is disabled (HISTORY_PATH is empty).")
+        return
+    
+    manager = tenant.session_manager
+    if context.args and context.args[0].isdigit():
+        number = int(context.args[0])
+        entry = await asyncio.to_thread(manager.get_history_entry, user_id, number)
+        if entry is None:
+            await update.message.reply_text(f"No command !{number} in your history.")
+            return
+        # Saved output of the earlier run, nothing is executed
+        await reply_paged(tenant, update.message, user_id, f"!{number} {entry['command']}",
+                          {'output': entry['output'] or '(no output)', 'exit_code': entry['exit_code']})
+        return
+    
+    everything = bool(context.args) and context.args[0] == 'all'
+    entries = await asyncio.to_thread(manager.get_history, user_id, 20, not everything)
+    if not entries:
+        scope = "" if everything else " in this session (try /history all)"
+        await update.message.reply_text(f"No commands{scope} yet.")
+        return
+    
+    lines = ["📜 *Command History*" + (" (all sessions)" if everything else "") + "\n"]
+    session = None
+    for entry in entries:
+        if everything and entry['session'] != session:
+            session = entry['session']
+            lines.append(f"— session {datetime.strptime(session, '%Y%m%d-%H%M%S'):%Y-%m-%d %H:%M}")
+        lines.append(format_history_line(entry))
+    lines.append("\nRun again with `!n`, see a saved output with `/history n`.")
+    await send_markdown(update.message.reply_text, "\n".join(lines))
+
+async def grep_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Search the outputs and commands of past runs, nothing is run on the server"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    if command_history is None:
+        await update.message.reply_text("Command history is disabled (HISTORY_PATH is empty).")
+        return
+    
+    if not context.args:
+        await update.message.reply_text("Usage: /grep <pattern>")
+        return
+    
+    pattern = update.message.text.split(None, 1)[1].strip()
+    results = await asyncio.to_thread(tenant.session_manager.search_history, user_id, pattern)
+    if not results:
+        await update.message.reply_text(f"No past output contains \"{pattern}\".")
+        return
+    
+    parts = [f"🔎 *{len(results)} match(es)* for `{pattern[:60]}`"]
+    for entry in results:
+        part = format_history_line(entry)
+        if entry['lines']:
+            part += "\n```\n" + '\n'.join(line[:200] for line in entry['lines']) + "\n```"
+        parts.append(part)
+    response = "\n\n".join(parts)
+    if len(response) > 4000:
+        response = "\n\n".join(parts[:1] + [format_history_line(entry) for entry in results])
+    await send_markdown(update.message.reply_text, response)
+
+def format_size(size):
+    """Human readable byte count like 12.3 MB"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def session_cwd(tenant, user_id):
+    """Directory the user's session is in, relative remote paths start there"""
+    return tenant.session_manager.sessions.get(user_id, {}).get('current_dir', tenant.working_dir)
+
+async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send a remote file as a document, streamed over SFTP and gzipped if it is text"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    if not context.args:
+        await update.message.reply_text("Usage: /get <path>")
+        return
+    
+    path = resolve_remote_path(update.message.text.split(None, 1)[1], session_cwd(tenant, user_id))
+    status = await update.message.reply_text(f"📥 Fetching {path}...")
+    try:
+        fetched = await asyncio.to_thread(
+            file_transfer.fetch, tenant.ssh_host, tenant.ssh_port, tenant.ssh_username, tenant.ssh_password, path
+        )
+    except Exception as e:
+        audit(tenant, user_id, 'get', command=f"/get {path}", path=path, exit_code=1, error=str(e))
+        await status.edit_text(f"❌ Cannot fetch {path}: {e}")
+        return
+    
+    caption = f"📄 {path} ({format_size(fetched['size'])}"
+    if fetched['gzipped']:
+        caption += f", gzip {format_size(fetched['bytes'])}"
+    try:
+        with open(fetched['path'], 'rb') as f:
+            await update.message.reply_document(
+                StreamedInputFile(f, fetched['filename']),
+                caption=caption + ")",
+                write_timeout=FILE_TRANSFER_TIMEOUT
+            )
+    except Exception as e:
+        audit(tenant, user_id, 'get', command=f"/get {path}", path=path, exit_code=1,
+              output_bytes=fetched['size'], error=f"upload to Telegram failed: {e}")
+        await status.edit_text(f"❌ Upload to Telegram failed: {e}")
+        return
+    finally:
+        os.remove(fetched['path'])
+    audit(tenant, user_id, 'get', command=f"/get {path}", path=path, exit_code=0, output_bytes=fetched['size'])
+    await status.delete()
+
+async def put_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Write the document replied to onto the server, streamed into pipelined SFTP writes"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    replied = update.message.reply_to_message
+    document = replied.document if replied else None
+    if document is None:
+        await update.message.reply_text("Reply to a file with /put [remote path] to upload it.")
+        return
+    if document.file_size and document.file_size > FILE_DOWNLOAD_MAX_MB * 1024 * 1024:
+        await update.message.reply_text(f"❌ Bots can only download files up to {FILE_DOWNLOAD_MAX_MB} MB.")
+        return
+    
+    # Default is the document's name in the session directory
+    filename = document.file_name or f"upload_{document.file_unique_id}"
+    target = update.message.text.split(None, 1)[1] if context.args else filename
+    path = resolve_remote_path(target, session_cwd(tenant, user_id))
+    status = await update.message.reply_text(f"📤 Uploading {filename} to {path}...")
+    
+    try:
+        telegram_file = await context.bot.get_file(document.file_id)
+        upload = await asyncio.to_thread(
+            file_transfer.open_upload,
+            tenant.ssh_host, tenant.ssh_port, tenant.ssh_username, tenant.ssh_password, path, filename
+        )
+    except Exception as e:
+        audit(tenant, user_id, 'put', command=f"/put {path}", path=path, filename=filename, exit_code=1, error=str(e))
+        await status.edit_text(f"❌ Cannot upload to {path}: {e}")
+        return
+    
+    try:
+        # Chunks go to the server as they arrive, the file is never held in memory
+        async with httpx.AsyncClient(timeout=FILE_TRANSFER_TIMEOUT) as client:
+            async with client.stream('GET', telegram_file.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(256 * 1024):
+                    await asyncio.to_thread(upload.write, chunk)
+        await asyncio.to_thread(upload.close)
+    except Exception as e:
+        await asyncio.to_thread(upload.abort)
+        audit(tenant, user_id, 'put', command=f"/put {upload.path}", path=upload.path, filename=filename,
+              exit_code=1, output_bytes=upload.bytes, error=str(e))
+        await status.edit_text(f"❌ Upload to {path} failed: {e}")
+        return
+    
+    audit(tenant, user_id, 'put', command=f"/put {upload.path}", path=upload.path, filename=filename,
+          exit_code=0, output_bytes=upload.bytes)
+    await status.edit_text(f"✅ Saved {upload.path} ({format_size(upload.bytes)})")
+
+def format_fanout(results):
+    """Per-host results, hosts with identical output share one block"""
+    blocks = []
+    for group in fold_results(results):
+        first = group[0]
+        if first['error']:
+            status = f"⚠️ {first['error']}"
+        elif first['exit_code'] == 0:
+            status = "✅ exit 0"
+        else:
+            status = f"❌ exit {first['exit_code'] if first['exit_code'] is not None else '?'}"
+        block = f"── {', '.join(result['host'] for result in group)} ({status})"
+        if first['output']:
+            block += f"\n{first['output']}"
+        blocks.append(block)
+    return '\n\n'.join(blocks)
+
+async def fanout_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Run a command on every host of a group in parallel and fold identical outputs"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    if not tenant.is_authorized(user_id):
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    if len(context.args) < 2 or context.args[0] not in tenant.host_groups:
+        groups = ', '.join(f"{name} ({len(hosts)})" for name, hosts in tenant.host_groups.items())
+        await update.message.reply_text(
+            f"Usage: /fanout <group> <command>\nGroups: {groups or 'none configured (HOST_GROUPS)'}"
+        )
+        return
+    
+    group = context.args[0]
+    command = update.message.text.split(None, 2)[2]
+    hosts = tenant.host_groups[group]
+    status = await update.message.reply_text(f"🌐 Running on {len(hosts)} host(s) of {group}...")
+    
+    started = time.monotonic()
+    results = await asyncio.to_thread(fanout.run, hosts, command, tenant.ssh_username, tenant.ssh_password)
+    elapsed = time.monotonic() - started
+    
+    ok = sum(1 for result in results if not result['error'] and result['exit_code'] == 0)
+    output = format_fanout(results)
+    audit(
+        tenant, user_id, 'fanout', command=command, group=group,
+        hosts=[{'host': result['host'], 'exit_code': result['exit_code'], 'error': result['error']}
+               for result in results],
+        exit_code=0 if ok == len(results) else 1, duration=round(elapsed, 3), output=output
+    )
+    slowest = max(results, key=lambda result: result['elapsed'])
+    await status.edit_text(
+        f"🌐 {group}: {ok}/{len(results)} host(s) ok in {elapsed:.1f}s "
+        f"(slowest {slowest['host']}, {slowest['elapsed']:.1f}s)"
+    )
+    await reply_paged(tenant, update.message, user_id, f"[{group}] {command}",
+                      {'output': output, 'exit_code': None})
+
+def register_gauges():
+    """Point-in-time values, read only when /stats or /metrics asks"""
+    def sessions(state):
+        return {
+            (('tenant', tenant.name),): sum(
+                1 for user_id, session in list(tenant.session_manager.sessions.items())
+                if tenant.session_manager.session_active.get(user_id) and ('shell' in session) == (state == 'open')
+            )
+            for tenant in list(tenants.values())
+        }
+    
+    metrics.add_gauge('sessions_open', lambda: sessions('open'))
+    metrics.add_gauge('sessions_hibernated', lambda: sessions('hibernated'))
+    metrics.add_gauge('queue_depth', lambda: sum(
+        len(session['pending'])
+        for tenant in list(tenants.values())
+        for session in list(tenant.session_manager.sessions.values())
+    ))
+    metrics.add_gauge('ssh_transports', lambda: ssh_pool.stats()['transports'])
+    metrics.add_gauge('ssh_channels', lambda: ssh_pool.stats()['channels'])
+    metrics.add_gauge('job_channels', lambda: governor.stats()['job_channels'])
+    metrics.add_gauge('outbound_waiting', lambda: sum(
+        len(tenant.scheduler.waiting) for tenant in list(tenants.values()) if tenant.scheduler is not None
+    ))
+    metrics.add_gauge('output_store_bytes', lambda: output_store.stats()['memory_bytes'])
+    if audit_log is not None:
+        metrics.add_gauge('audit_pending', audit_log.pending)
+
+def format_stats():
+    """Human readable summary of the metrics for /stats"""
+    gauges = metrics.read_gauges()
+    uptime = time.time() - metrics.started
+    lines = [
+        f"uptime       {format_runtime(uptime)}",
+        f"commands     {metrics.total('commands_total')} total, {metrics.rate('commands_total'):.2f}/s (1 min)",
+        f"sessions     {sum(gauges['sessions_open'].values())} open, "
+        f"{sum(gauges['sessions_hibernated'].values())} hibernated, queue depth {gauges['queue_depth']}",
+        f"ssh          {gauges['ssh_transports']} transports, {gauges['ssh_channels']} channels, "
+        f"{metrics.total('reconnects_total')} reconnects, "
+        f"{metrics.total('ssh_bytes_read_total') / (1024 * 1024):.1f} MB read",
+        f"telegram     {metrics.rate('telegram_requests_total'):.2f} req/s, "
+        f"{metrics.total('telegram_retry_after_total')} RetryAfter, {gauges['outbound_waiting']} waiting",
+        "",
+        f"{'stage':<13}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}"
+    ]
+    for labels, (count, p50, p95, p99) in metrics.stages('stage_seconds').items():
+        stage = dict(labels).get('stage', '')
+        lines.append(f"{stage:<13}{count:>7}" + ''.join(f"{value * 1000:>7.1f}ms" for value in (p50, p95, p99)))
+    return '\n'.join(lines)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin view of throughput, stage latencies and resource use"""
+    user_id = update.effective_user.id
+    tenant = get_tenant(context)
+    
+    allowed = str(user_id) in ADMIN_USERS if ADMIN_USERS else tenant.is_authorized(user_id)
+    if not allowed:
+        await update.message.reply_text("Unauthorized access")
+        return
+    
+    await update.message.reply_text(f"📈 *Bot Stats*\n```\n{format_stats()}\n```", parse_mode='Markdown')
 
 async def session_monitor(context: ContextTypes.DEFAULT_TYPE):
     """Monitor session activity - runs every 10 minutes"""
     user_id = context.job.data
-    session_info = session_manager.get_session_info(user_id)
+    tenant = get_tenant(context)
+    session_info = tenant.session_manager.get_session_info(user_id)
     
     if session_info['active']:
         duration_minutes = int(session_info['duration'].total_seconds() / 60)
@@ -332,22 +1011,74 @@ async def session_monitor(context: ContextTypes.DEFAULT_TYPE):
                  f"💤 Idle for: {session_info['last_activity']} seconds\n\n"
                  f"Session will remain open until you use /stop",
             parse_mode='Markdown',
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            # Reminders yield to command replies when the bot is at its rate limit
+            rate_limit_args={'priority': PRIORITY_BACKGROUND}
         )
 
+async def pool_maintenance():
+    """Hibernate idle sessions, then close dead and idle pooled SSH transports - runs every minute"""
+    hibernated = await asyncio.to_thread(governor.reap)
+    if hibernated:
+        print(f"💤 Hibernated {hibernated} session(s) idle for over {SESSION_IDLE_TIMEOUT}s")
+    
+    evicted = ssh_pool.evict_idle() + fanout_pool.evict_idle()
+    if evicted:
+        print(f"🔌 Evicted {evicted} idle SSH transport(s)")
+
+async def watch_web_config():
+    """Poll the web config and apply changes live - runs every CONFIG_POLL_INTERVAL seconds"""
+    for tenant in list(restart_pending.values()):
+        await start_or_retry(tenant)
+    
+    # Conditional request off the event loop, unchanged config is a bodiless 304
+    if not await asyncio.to_thread(web_config.refresh):
+        return
+    
+    configs = tenant_configs()
+    if not configs:
+        print("⚠️ Ignoring incomplete web config update")
+        return
+    
+    for key, (name, env) in configs.items():
+        tenant = tenants.get(key)
+        if tenant is None:
+            # New bot configuration, or one still failing to start rebuilt from the new env
+            await start_or_retry(build_tenant(key, name, env))
+            continue
+        
+        changes = tenant.apply_env(env, [other for other in tenants.values() if other is not tenant])
+        if not changes:
+            continue
+        print(f"🔁 [{tenant.name}] Web config changed: {', '.join(sorted(changes))}")
+        if 'TELEGRAM_BOT_TOKEN' in changes:
+            # Same sessions, served through a new Application for the new token
+            await stop_application(tenant)
+            await start_or_retry(tenant)
+    
+    for key in [key for key in restart_pending if key not in configs and key not in tenants]:
+        del restart_pending[key]
+    for key in [key for key in tenants if key not in configs]:
+        restart_pending.pop(key, None)
+        tenant = tenants.pop(key)
+        print(f"👋 [{tenant.name}] Bot configuration removed, stopping it")
+        await stop_application(tenant)
+        await asyncio.get_running_loop().run_in_executor(tenant.session_manager.executor, tenant.stop_all_sessions)
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button callbacks"""
     query = update.callback_query
     user_id = query.from_user.id
+    tenant = get_tenant(context)
     
-    if not is_authorized(user_id):
+    if not tenant.is_authorized(user_id):
         await query.answer("Unauthorized", show_alert=True)
         return
     
     await query.answer()
     
     if query.data == 'session_info':
-        session_info = session_manager.get_session_info(user_id)
+        session_info = tenant.session_manager.get_session_info(user_id)
         if session_info['active']:
             duration_minutes = int(session_info['duration'].total_seconds() / 60)
             await query.message.reply_text(
@@ -356,7 +1087,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"⏱️ Duration: {duration_minutes} minutes\n"
                 f"📝 Commands: {session_info['commands_count']}\n"
                 f"💤 Last activity: {session_info['last_activity']}s ago\n"
-                f"📁 Current dir: {session_info['current_dir']}",
+                f"📁 Current dir: {session_info['current_dir']}\n"
+                f"🔄 Reconnects: {session_info['reconnects']}" +
+                ("\n💤 Hibernated, reconnects on the next command" if session_info['hibernated'] else ""),
                 parse_mode='Markdown'
             )
         else:
@@ -393,11 +1126,29 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         cmd = commands.get(query.data, '')
         if cmd:
-            result = session_manager.execute_command(user_id, cmd)
-            await query.message.reply_text(
-                f"```bash\n$ {cmd}\n{result}\n```",
-                parse_mode='Markdown'
-            )
+            result = await tenant.session_manager.run_command(user_id, cmd)
+            await reply_paged(tenant, query.message, user_id, cmd, result)
+    
+    elif query.data.startswith('page:'):
+        _, output_id, page = query.data.split(':')
+        rendered = await asyncio.to_thread(render_page, output_id, int(page), user_id)
+        if rendered is None:
+            await query.message.reply_text("⌛ This output has expired. Run the command again.")
+            return
+        response, reply_markup = rendered
+        await send_markdown(query.message.edit_text, response, reply_markup=reply_markup)
+    
+    elif query.data.startswith('dl:'):
+        output_id = query.data.split(':', 1)[1]
+        document = await asyncio.to_thread(output_store.get_document, output_id)
+        if document is None or document[0]['user_id'] != user_id:
+            await query.message.reply_text("⌛ This output has expired. Run the command again.")
+            return
+        info, data = document
+        await query.message.reply_document(
+            InputFile(data, filename=f"output_{output_id}.txt"),
+            caption=f"$ {info['command'][:200]}"
+        )
     
     elif query.data == 'claude_menu':
         keyboard = [
@@ -414,13 +1165,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def claude_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle Claude Code commands"""
     user_id = update.effective_user.id
+    tenant = get_tenant(context)
     
-    if not is_authorized(user_id):
+    if not tenant.is_authorized(user_id):
         await update.message.reply_text("Unauthorized access")
         return
     
     # Check session
-    session_info = session_manager.get_session_info(user_id)
+    session_info = tenant.session_manager.get_session_info(user_id)
     if not session_info['active']:
         await update.message.reply_text(
             "No active session. Use /start to begin a new session."
@@ -434,37 +1186,224 @@ async def claude_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Please provide a query for Claude Code")
         return
     
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    stream = MessageStream(update.message, '', title="🤖 *Claude Code Response:*", interval=STREAM_INTERVAL,
+                           screen=tenant.session_manager.get_screen(user_id), metrics=metrics)
+    await stream.start(queue_placeholder(tenant, user_id))
     
     # Execute Claude command
-    claude_cmd = f'{CLAUDE_CODE_PATH} "{query}"'
-    result = session_manager.execute_command(user_id, claude_cmd)
-    
-    # Send result
-    response = f"🤖 *Claude Code Response:*\n```\n{result}\n```"
-    
-    if len(response) > 4096:
-        for i in range(0, len(response), 4096):
-            await update.message.reply_text(response[i:i+4096], parse_mode='Markdown')
-    else:
-        await update.message.reply_text(response, parse_mode='Markdown')
+    claude_cmd = f'{tenant.claude_code_path} "{query}"'
+    result = await tenant.session_manager.run_command(user_id, claude_cmd, on_output=stream.feed)
+    await stream.finish(result, format_exit_status(result), await browse_keyboard(tenant, user_id, claude_cmd, result))
 
-def main():
-    """Main function"""
-    # Create application
-    app = Application.builder().token(BOT_TOKEN).build()
+def build_application(tenant):
+    """Application for one tenant's bot token, handlers find the tenant in bot_data"""
+    # Every Bot API call goes through the tenant's rate-aware scheduler
+    scheduler = OutboundScheduler(
+        global_rate=OUTBOUND_GLOBAL_RATE,
+        chat_rate=OUTBOUND_CHAT_RATE,
+        chat_burst=OUTBOUND_CHAT_BURST,
+        group_rate=OUTBOUND_GROUP_RATE,
+        metrics=metrics
+    )
+    tenant.scheduler = scheduler
+    # Updates from different users are handled concurrently
+    app = (Application.builder().token(tenant.bot_token).concurrent_updates(CONCURRENT_UPDATES)
+           .rate_limiter(scheduler).build())
+    app.bot_data['tenant'] = tenant
     
     # Add handlers
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("stop", stop))
     app.add_handler(CommandHandler("claude", claude_command))
+    app.add_handler(CommandHandler("cancel", cancel_command))
+    app.add_handler(CommandHandler("queue", queue_command))
+    app.add_handler(CommandHandler("bg", bg_command))
+    app.add_handler(CommandHandler("jobs", jobs_command))
+    app.add_handler(CommandHandler("tail", tail_command))
+    app.add_handler(CommandHandler("screen", screen_command))
+    app.add_handler(CommandHandler("fanout", fanout_command))
+    app.add_handler(CommandHandler("get", get_command))
+    app.add_handler(CommandHandler("put", put_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("history", history_command))
+    app.add_handler(CommandHandler("grep", grep_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_command))
     app.add_handler(CallbackQueryHandler(button_callback))
+    return app
+
+def webhook_path(tenant):
+    return f"/telegram/{hashlib.sha256(tenant.key.encode()).hexdigest()[:16]}"
+
+def webhook_secret(tenant):
+    """Per-tenant secret token, Telegram echoes it in every webhook request"""
+    return hmac.new(WEBHOOK_SECRET.encode(), tenant.key.encode(), hashlib.sha256).hexdigest()
+
+async def start_webhook(tenant, app):
+    """Route the tenant's webhook into its update queue, False if Telegram refused it"""
+    path = webhook_path(tenant)
+    
+    async def enqueue(data):
+        # Processed by the Application at its concurrent_updates limit
+        await app.update_queue.put(Update.de_json(data, app.bot))
+    
+    webhook_server.add_route(path, webhook_secret(tenant), enqueue)
+    try:
+        certificate = None
+        if WEBHOOK_CERT:
+            # Uploaded so Telegram also accepts a self-signed certificate
+            with open(WEBHOOK_CERT, 'rb') as f:
+                certificate = f.read()
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL + path,
+            certificate=certificate,
+            secret_token=webhook_secret(tenant),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+    except Exception as e:
+        print(f"⚠️ [{tenant.name}] setWebhook failed ({e}), falling back to polling")
+        webhook_server.remove_route(path)
+        return False
+    return True
+
+async def start_tenant(tenant):
+    """Start receiving updates for a tenant's bot on the running event loop"""
+    app = build_application(tenant)
+    try:
+        await app.initialize()
+        await app.start()
+        # Webhook when configured, long polling as the fallback
+        if webhook_server is None or not await start_webhook(tenant, app):
+            await app.updater.start_polling()
+    except Exception as e:
+        print(f"❌ [{tenant.name}] Failed to start bot: {e}")
+        # Free the half-started Application, a retry builds a fresh one
+        try:
+            if app.running:
+                await app.stop()
+            await app.shutdown()
+        except Exception:
+            pass
+        return False
+    tenant.application = app
+    tenants[tenant.key] = tenant
+    
+    # Journaled sessions come back without SSH, the shell reconnects on the next command
+    restored = await asyncio.get_running_loop().run_in_executor(
+        tenant.session_manager.executor, tenant.session_manager.restore
+    )
+    schedule_monitors(tenant, app)
+    print(f"🤖 [{tenant.name}] Bot started" + (f", {len(restored)} session(s) restored" if restored else ""))
+    return True
+
+async def start_or_retry(tenant):
+    """start_tenant, keeping the tenant for a retry on the next config poll when it fails"""
+    if await start_tenant(tenant):
+        restart_pending.pop(tenant.key, None)
+        return True
+    restart_pending[tenant.key] = tenant
+    return False
+
+def schedule_monitors(tenant, app):
+    """(Re)create the activity reminder jobs of the tenant's open sessions"""
+    manager = tenant.session_manager
+    for user_id, session in list(manager.sessions.items()):
+        interval = session.get('monitor_interval')
+        if not interval or not manager.session_active.get(user_id):
+            continue
+        app.job_queue.run_repeating(
+            session_monitor,
+            interval=interval,
+            first=interval,
+            data=user_id,
+            name=f"monitor_{user_id}"
+        )
+
+async def stop_application(tenant):
+    app = tenant.application
+    tenant.application = None
+    if app is None:
+        return
+    if webhook_server is not None:
+        webhook_server.remove_route(webhook_path(tenant))
+    try:
+        if app.updater.running:
+            await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+    except Exception as e:
+        print(f"⚠️ [{tenant.name}] Error while stopping bot: {e}")
+
+async def run_periodic(job, interval, first):
+    """Run a process-wide job forever, errors are logged and the loop goes on"""
+    await asyncio.sleep(first)
+    while True:
+        try:
+            await job()
+        except Exception as e:
+            print(f"⚠️ {job.__name__} failed: {e}")
+        await asyncio.sleep(interval)
+
+async def run_bots():
+    """Serve every tenant from one event loop and one SSH pool until SIGINT/SIGTERM"""
+    if webhook_server is not None:
+        await webhook_server.start()
+    register_gauges()
+    if metrics_server is not None:
+        metrics_server.add_page('/metrics', metrics.render_prometheus)
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            # Metrics are optional, the bots run without the endpoint
+            print(f"⚠️ Metrics server not started on {METRICS_LISTEN}:{METRICS_PORT}: {e}")
+    for key, (name, env) in tenant_configs().items():
+        await start_or_retry(build_tenant(key, name, env))
+    if not tenants:
+        print("❌ No bot could be started")
+        return
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    # Startup never waits on the config site: a snapshot boot is revalidated right away,
+    # a fresh fetch only on the next poll
+    first_check = 1 if web_config.last_update == 0 else CONFIG_POLL_INTERVAL
+    background = [
+        # Periodic SSH pool health check and idle eviction
+        asyncio.create_task(run_periodic(pool_maintenance, 60, 60)),
+        asyncio.create_task(run_periodic(watch_web_config, CONFIG_POLL_INTERVAL, first_check))
+    ]
     
     # Start bot
-    print("🤖 Persistent Telegram Terminal Bot started...")
+    print(f"🤖 Persistent Telegram Terminal Bot started ({len(tenants)} bot(s))...")
     print("Sessions will remain active until explicitly stopped with /stop")
-    app.run_polling()
+    await stop_event.wait()
+    
+    print("🛑 Shutting down...")
+    for task in background:
+        task.cancel()
+    # Sessions stay in the journal and resume after the restart
+    for tenant in list(tenants.values()):
+        await stop_application(tenant)
+    if webhook_server is not None:
+        await webhook_server.stop()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    fanout.shutdown()
+    ssh_pool.close_all()
+    fanout_pool.close_all()
+    if session_journal is not None:
+        session_journal.close()
+    if audit_log is not None:
+        audit_log.close()
+    if command_history is not None:
+        command_history.close()
+
+def main():
+    """Main function"""
+    asyncio.run(run_bots())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
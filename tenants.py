@@ -0,0 +1,118 @@
+import os
+import re
+from session_manager import SessionManager
+from background_jobs import BackgroundJobManager
+from config_loader import diff_env_vars
+from fanout import parse_host_groups
+
+# Changing any of these moves the tenant's sessions to the new SSH target
+SSH_KEYS = ('SSH_HOST', 'SSH_PORT', 'SSH_USERNAME', 'SSH_PASSWORD')
+
+
+class Tenant:
+    """One bot configuration served by this process.
+
+    Each tenant has its own bot token, allowed users, SessionManager and
+    BackgroundJobManager. Tenants share the SSH pool, but every session
+    manager has its own worker threads, so a busy project cannot starve the
+    others. `max_sessions` caps concurrent sessions (0 = unlimited).
+    """
+
+    def __init__(self, key, name, env, pool, max_sessions=0, job_log_dir='logs/jobs',
+                 job_log_max_bytes=1024 * 1024, max_bg_jobs=5, governor=None, audit=None, **session_options):
+        self.key = key
+        self.name = name or key
+        self.pool = pool
+        self.max_sessions = max_sessions
+        self.application = None
+        # OutboundScheduler of the running Application
+        self.scheduler = None
+        self.env = {}
+        self._load(env)
+
+        self.session_manager = SessionManager(
+            self.ssh_host, self.ssh_port, self.ssh_username, self.ssh_password,
+            working_dir=self.working_dir,
+            pool=pool,
+            journal_key=key,
+            governor=governor,
+            audit=audit,
+            **session_options
+        )
+
+        # Job ids restart at 1 per manager, so each tenant logs to its own directory
+        slug = re.sub(r'[^A-Za-z0-9_.-]', '_', key)
+        self.job_manager = BackgroundJobManager(
+            pool, self.ssh_host, self.ssh_port, self.ssh_username, self.ssh_password,
+            log_dir=os.path.join(job_log_dir, slug),
+            max_log_bytes=job_log_max_bytes,
+            max_running=max_bg_jobs,
+            governor=governor,
+            audit=audit,
+            audit_key=key
+        )
+
+    def _load(self, env):
+        self.env = dict(env)
+        self.bot_token = env.get('TELEGRAM_BOT_TOKEN', '')
+        self.chat_id = env.get('TELEGRAM_CHAT_ID', '')
+        self.ssh_host = env.get('SSH_HOST', 'localhost')
+        self.ssh_port = int(env.get('SSH_PORT') or 22)
+        self.ssh_username = env.get('SSH_USERNAME', 'root')
+        self.ssh_password = env.get('SSH_PASSWORD', '')
+        self.allowed_users = env.get('ALLOWED_USERS', '').split(',')
+        self.max_output_length = int(env.get('MAX_OUTPUT_LENGTH') or 4000)
+        self.working_dir = env.get('WORKING_DIR', '/root')
+        self.claude_code_path = env.get('CLAUDE_CODE_PATH', '/usr/local/bin/claude')
+        # Fleet for /fanout, hosts use the tenant's SSH credentials unless they name a user
+        self.host_groups = parse_host_groups(env.get('HOST_GROUPS', ''))
+
+    def is_authorized(self, user_id):
+        """Check if user is authorized for this bot"""
+        return str(user_id) in self.allowed_users or not self.allowed_users[0]
+
+    @property
+    def page_size(self):
+        return min(self.max_output_length, 3500)
+
+    def session_limit_reached(self):
+        if not self.max_sessions:
+            return False
+        active = sum(1 for active in self.session_manager.session_active.values() if active)
+        return active >= self.max_sessions
+
+    def ssh_credentials(self):
+        return self.ssh_host, self.ssh_port, self.ssh_username, self.ssh_password
+
+    def apply_env(self, env, others=()):
+        """Apply a changed configuration live, returns {key: (old, new)} of what changed.
+
+        Users, output limits and paths are swapped in place; new SSH settings
+        move sessions over one by one (see SessionManager.retarget). A new bot
+        token is only recorded, the caller restarts the Application. `others`
+        are the process's other tenants: transports of the old credentials
+        are kept while one of them still logs in with those.
+        """
+        changes = diff_env_vars(self.env, env)
+        if not changes:
+            return changes
+
+        old_credentials = self.ssh_credentials()
+        self._load(env)
+        # Default for new sessions, open sessions keep their current directory
+        self.session_manager.working_dir = self.working_dir
+
+        if any(key in changes for key in SSH_KEYS):
+            moved = self.session_manager.retarget(self.ssh_host, self.ssh_port, self.ssh_username, self.ssh_password)
+            # The old transports must not outlive old credentials, running commands finish on them
+            if not any(other.ssh_credentials() == old_credentials for other in others):
+                self.pool.retire(*old_credentials)
+            self.job_manager.ssh_host, self.job_manager.ssh_port = self.ssh_host, self.ssh_port
+            self.job_manager.ssh_username, self.job_manager.ssh_password = self.ssh_username, self.ssh_password
+            print(f"🔀 [{self.name}] SSH target is now {self.ssh_username}@{self.ssh_host}:{self.ssh_port}, "
+                  f"{moved} session(s) move on their next command")
+        return changes
+
+    def stop_all_sessions(self):
+        for user_id in [u for u, active in self.session_manager.session_active.items() if active]:
+            self.session_manager.stop_session(user_id)
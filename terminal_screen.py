@@ -0,0 +1,285 @@
+import re
+import threading
+import unicodedata
+
+# Output that only appends lines: no cursor movement, lone \r, backspace or non-CSI escapes
+NON_LINEAR_PATTERN = re.compile(r'\x1b\[[0-9;?]*[^0-9;?mK]|\r(?!\n)|\x08|\x1b[^\[]')
+
+# Sequences that redraw in place, their presence switches a stream to screen mode
+REDRAW_PATTERN = re.compile(r'\x1b\[[0-9;?]*[ABCDEFGHJfdSTLM]|\x1b\[\?(?:1049|1047|47)h|\r(?!\n)')
+
+CSI_PATTERN = re.compile(r'\[([0-?]*)[ -/]*([@-~])')
+
+# A complete escape sequence, anything else at the end of a chunk is held back
+COMPLETE_ESCAPE_PATTERN = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07]*\x07|[^\[\]])')
+
+
+class TerminalScreen:
+    """Minimal VT100 screen model for one session.
+
+    The raw output stream (escape sequences included) is applied to a fixed
+    rows x cols grid, so programs that redraw in place (top, progress bars,
+    curses UIs) render as the screen a terminal would show instead of a pile
+    of control codes. Feeding is incremental and thread-safe; a sequence cut
+    off at the end of a chunk is completed by the next one. Plain appended
+    output takes a fast path that only replays the lines still on screen.
+    """
+
+    def __init__(self, cols=80, rows=24):
+        self.cols = cols
+        self.rows = rows
+        self.lock = threading.Lock()
+        self.pending = ''
+        self.redraws = 0
+        self.reset()
+
+    def reset(self):
+        self.grid = [[' '] * self.cols for _ in range(self.rows)]
+        self.saved_grid = None
+        self.x = 0
+        self.y = 0
+        self.saved_cursor = (0, 0)
+        self.top = 0
+        self.bottom = self.rows - 1
+
+    def begin_command(self):
+        """Forget redraw activity from earlier commands"""
+        with self.lock:
+            self.redraws = 0
+
+    @property
+    def interactive(self):
+        """True when the current command redrew the screen in place"""
+        return self.redraws > 0
+
+    def feed(self, text):
+        with self.lock:
+            text = self.pending + text
+            self.pending = ''
+
+            # Keep a possibly incomplete escape sequence for the next chunk
+            escape = text.rfind('\x1b', max(0, len(text) - 256))
+            if escape >= 0 and not COMPLETE_ESCAPE_PATTERN.match(text, escape):
+                text, self.pending = text[:escape], text[escape:]
+
+            if REDRAW_PATTERN.search(text):
+                self.redraws += 1
+            elif text.count('\n') >= self.rows and not NON_LINEAR_PATTERN.search(text):
+                # Everything but the last rows-1 lines scrolls off, replay only those
+                cut = len(text)
+                for _ in range(self.rows):
+                    cut = text.rfind('\n', 0, cut)
+                self.grid = [[' '] * self.cols for _ in range(self.rows)]
+                self.x = self.y = 0
+                text = text[cut + 1:]
+
+            self._apply(text)
+
+    def render(self):
+        """Screen content as lines, trailing blanks trimmed"""
+        with self.lock:
+            lines = [''.join(row).rstrip() for row in self.grid]
+        while lines and not lines[-1]:
+            lines.pop()
+        return lines
+
+    def diff(self, previous):
+        """(row, text) pairs that changed since a previous render()"""
+        current = self.render()
+        changed = []
+        for row in range(max(len(current), len(previous))):
+            old = previous[row] if row < len(previous) else ''
+            new = current[row] if row < len(current) else ''
+            if old != new:
+                changed.append((row, new))
+        return current, changed
+
+    def _apply(self, text):
+        i = 0
+        length = len(text)
+        while i < length:
+            char = text[i]
+            if char == '\x1b':
+                i = self._escape(text, i)
+                continue
+            if char == '\n':
+                self._linefeed()
+            elif char == '\r':
+                self.x = 0
+            elif char == '\x08':
+                self.x = max(0, self.x - 1)
+            elif char == '\t':
+                self.x = min(self.cols - 1, (self.x // 8 + 1) * 8)
+            elif char >= ' ':
+                self._put(char)
+            i += 1
+
+    def _put(self, char):
+        width = 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+        if self.x + width > self.cols:
+            self.x = 0
+            self._linefeed()
+        self.grid[self.y][self.x] = char
+        if width == 2:
+            self.grid[self.y][self.x + 1] = ''
+        self.x += width
+
+    def _linefeed(self):
+        if self.y == self.bottom:
+            self._scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+
+    def _scroll_up(self, count):
+        for _ in range(count):
+            del self.grid[self.top]
+            self.grid.insert(self.bottom, [' '] * self.cols)
+
+    def _scroll_down(self, count):
+        for _ in range(count):
+            del self.grid[self.bottom]
+            self.grid.insert(self.top, [' '] * self.cols)
+
+    def _escape(self, text, i):
+        """Apply the escape sequence starting at text[i], returns the index after it"""
+        if i + 1 >= len(text):
+            return len(text)
+        kind = text[i + 1]
+
+        if kind == '[':
+            match = CSI_PATTERN.match(text, i + 1)
+            if not match:
+                return i + 2
+            self._csi(match.group(1), match.group(2))
+            return match.end()
+
+        if kind == ']':
+            # OSC (window title etc.), ends with BEL or ST
+            end = text.find('\x07', i)
+            st = text.find('\x1b\\', i)
+            ends = [pos for pos in (end, st) if pos >= 0]
+            if not ends:
+                return len(text)
+            return min(ends) + (1 if min(ends) == end else 2)
+
+        if kind == '7':
+            self.saved_cursor = (self.x, self.y)
+        elif kind == '8':
+            self.x, self.y = self.saved_cursor
+        elif kind == 'M':
+            if self.y == self.top:
+                self._scroll_down(1)
+            else:
+                self.y = max(0, self.y - 1)
+        elif kind == 'D':
+            self._linefeed()
+        elif kind == 'E':
+            self.x = 0
+            self._linefeed()
+        elif kind == 'c':
+            self.reset()
+        elif kind in '()':
+            # Character set selection, one more byte
+            return i + 3
+        return i + 2
+
+    def _csi(self, params, command):
+        private = params.startswith('?')
+        values = [int(value) if value.isdigit() else 0 for value in params.lstrip('?').split(';')]
+        first = values[0] or 1
+
+        if private:
+            if command in 'hl' and values[0] in (47, 1047, 1049):
+                self._alternate_screen(command == 'h')
+            return
+
+        if command == 'A':
+            self.y = max(self.top if self.y >= self.top else 0, self.y - first)
+        elif command == 'B':
+            self.y = min(self.bottom if self.y <= self.bottom else self.rows - 1, self.y + first)
+        elif command == 'C':
+            self.x = min(self.cols - 1, self.x + first)
+        elif command == 'D':
+            self.x = max(0, self.x - first)
+        elif command == 'E':
+            self.x = 0
+            self.y = min(self.rows - 1, self.y + first)
+        elif command == 'F':
+            self.x = 0
+            self.y = max(0, self.y - first)
+        elif command == 'G':
+            self.x = min(self.cols - 1, first - 1)
+        elif command == 'd':
+            self.y = min(self.rows - 1, first - 1)
+        elif command in 'Hf':
+            row = values[0] or 1
+            col = values[1] if len(values) > 1 and values[1] else 1
+            self.y = min(self.rows - 1, row - 1)
+            self.x = min(self.cols - 1, col - 1)
+        elif command == 'J':
+            self._erase_display(values[0])
+        elif command == 'K':
+            self._erase_line(values[0])
+        elif command == 'L':
+            for _ in range(first):
+                del self.grid[self.bottom]
+                self.grid.insert(self.y, [' '] * self.cols)
+        elif command == 'M':
+            for _ in range(first):
+                del self.grid[self.y]
+                self.grid.insert(self.bottom, [' '] * self.cols)
+        elif command == 'P':
+            row = self.grid[self.y]
+            del row[self.x:self.x + first]
+            row.extend([' '] * (self.cols - len(row)))
+        elif command == '@':
+            row = self.grid[self.y]
+            row[self.x:self.x] = [' '] * first
+            del row[self.cols:]
+        elif command == 'X':
+            row = self.grid[self.y]
+            for col in range(self.x, min(self.cols, self.x + first)):
+                row[col] = ' '
+        elif command == 'S':
+            self._scroll_up(first)
+        elif command == 'T':
+            self._scroll_down(first)
+        elif command == 'r':
+            top = (values[0] or 1) - 1
+            bottom = (values[1] if len(values) > 1 and values[1] else self.rows) - 1
+            if 0 <= top < bottom < self.rows:
+                self.top, self.bottom = top, bottom
+                self.x = self.y = 0
+        # SGR (m) and anything else only affect attributes, ignored
+
+    def _erase_display(self, mode):
+        if mode == 0:
+            self._erase_line(0)
+            for row in range(self.y + 1, self.rows):
+                self.grid[row] = [' '] * self.cols
+        elif mode == 1:
+            self._erase_line(1)
+            for row in range(0, self.y):
+                self.grid[row] = [' '] * self.cols
+        else:
+            self.grid = [[' '] * self.cols for _ in range(self.rows)]
+
+    def _erase_line(self, mode):
+        row = self.grid[self.y]
+        if mode == 0:
+            start, end = self.x, self.cols
+        elif mode == 1:
+            start, end = 0, self.x + 1
+        else:
+            start, end = 0, self.cols
+        for col in range(start, min(end, self.cols)):
+            row[col] = ' '
+
+    def _alternate_screen(self, enable):
+        if enable and self.saved_grid is None:
+            self.saved_grid = (self.grid, self.x, self.y)
+            self.grid = [[' '] * self.cols for _ in range(self.rows)]
+            self.x = self.y = 0
+        elif not enable and self.saved_grid is not None:
+            self.grid, self.x, self.y = self.saved_grid
+            self.saved_grid = None
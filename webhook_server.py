@@ -0,0 +1,156 @@
+import json
+import hmac
+import asyncio
+
+# Telegram sends this header with the secret_token given to setWebhook
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+
+class WebhookServer:
+    """Minimal asyncio HTTP/1.1 server receiving Telegram webhook updates.
+
+    Every route is a path with its own secret token and an async handler
+    taking the decoded JSON update. Requests without the matching
+    X-Telegram-Bot-Api-Secret-Token header are rejected with 403. The handler
+    only has to enqueue the update, so Telegram gets its 200 right away and
+    processing happens at the Application's own concurrency. Connections are
+    kept alive, which Telegram uses when it has several updates queued.
+    Pages are plain-text GET endpoints, e.g. metrics for a local scraper.
+    Without an ssl_context it speaks plain HTTP and Telegram must reach it
+    through a proxy that terminates TLS.
+    """
+
+    def __init__(self, host='0.0.0.0', port=8443, max_body_bytes=1024 * 1024, idle_timeout=60, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.max_body_bytes = max_body_bytes
+        self.idle_timeout = idle_timeout
+        self.routes = {}
+        self.pages = {}
+        self.server = None
+        self.received = 0
+        self.rejected = 0
+
+    def add_route(self, path, secret, handler):
+        self.routes[path] = (secret, handler)
+
+    def remove_route(self, path):
+        self.routes.pop(path, None)
+
+    def add_page(self, path, render):
+        """Serve render() as text/plain on GET path"""
+        self.pages[path] = render
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port, ssl=self.ssl_context)
+        # Port 0 picks a free port, report the real one
+        self.port = self.server.sockets[0].getsockname()[1]
+        scheme = 'HTTPS' if self.ssl_context else 'HTTP'
+        print(f"🌐 {scheme} server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.idle_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+                    break
+                except ValueError:
+                    # Malformed Content-Length, the body cannot be skipped so the connection ends
+                    await self._respond(writer, 400, False, None)
+                    break
+                if request is None:
+                    break
+
+                status, keep_alive, body = await self._dispatch(*request)
+                await self._respond(writer, status, keep_alive, body)
+                if not keep_alive:
+                    break
+        except OSError:
+            # Client went away while the response was written
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, keep_alive, body):
+        if body is None:
+            body = b'ok' if status == 200 else REASONS.get(status, '').encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _read_request(self, reader):
+        """Returns (method, path, headers, body) or None when the client closed.
+
+        Raises ValueError for a Content-Length that is not a non-negative integer.
+        """
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length < 0:
+            raise ValueError(f"negative Content-Length {length}")
+        if length > self.max_body_bytes:
+            return method, target, headers, None
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    async def _dispatch(self, method, target, headers, body):
+        """Handle one request, returns (status, keep_alive, body or None for the default)"""
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        path = target.split('?', 1)[0]
+
+        if path == '/healthz':
+            return 200, keep_alive, None
+        if path in self.pages and method == 'GET':
+            return 200, keep_alive, self.pages[path]().encode()
+        route = self.routes.get(path)
+        if route is None:
+            return 404, keep_alive, None
+        if method != 'POST':
+            return 405, keep_alive, None
+        if body is None:
+            # Body was not read, the connection cannot be reused
+            return 413, False, None
+
+        secret, handler = route
+        # Compared as bytes, compare_digest refuses str with non-ASCII characters
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode('latin-1'), secret.encode()):
+            self.rejected += 1
+            return 403, keep_alive, None
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, keep_alive, None
+
+        self.received += 1
+        try:
+            await handler(data)
+        except Exception as e:
+            print(f"⚠️ Webhook handler error on {path}: {e}")
+        return 200, keep_alive, None